@@ -1,7 +1,11 @@
 import json, random, re, hashlib, argparse, itertools, yaml, os
 from pathlib import Path
 from difflib import SequenceMatcher
-import requests
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ollama_client
+import completion_cache
+CACHE = completion_cache.from_env()  # set COMPLETION_CACHE_PATH to replay earlier completions
 
 def norm(s): return re.sub(r"\s+"," ", s.lower().strip())
 def sig_text(s): return hashlib.sha256(norm(s).encode()).hexdigest()
@@ -59,8 +63,13 @@ def too_similar(s, seen_texts, thr):
 
 # ---------- Ollama LLM generation ----------
 def ollama_chat(messages, model, host):
-    url = f"{host.rstrip('/')}/api/chat"
-    r = requests.post(url, json={"model": model, "messages": messages, "options":{"temperature":0.6}}, timeout=90)
+    payload = {"model": model, "messages": messages, "options":{"temperature":0.6}}
+    if CACHE is not None:
+        return CACHE.get_or_call(lambda: _post_chat(host, payload), api="/api/chat", payload=payload, sample=0)
+    return _post_chat(host, payload)
+
+def _post_chat(host, payload):
+    r = ollama_client.post(host, "/api/chat", payload, timeout=90)
     r.raise_for_status()
     return r.json()["message"]["content"]
 
@@ -191,6 +200,8 @@ def main(args):
 
     Path(args.out).write_text("\n".join(json.dumps(x, ensure_ascii=False) for x in out_rows))
     print(f"generated={len(out_rows)}  wrote={args.out}")
+    if CACHE is not None:
+        print(f"completion cache: {CACHE.stats()}")
 
 if __name__ == "__main__":
     ap = argparse.ArgumentParser()
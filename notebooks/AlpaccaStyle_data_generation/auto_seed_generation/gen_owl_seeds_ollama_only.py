@@ -1,7 +1,11 @@
 import json, argparse, os, re, hashlib, random, time
 from pathlib import Path
 from difflib import SequenceMatcher
-import requests
+import sys
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ollama_client
+import completion_cache
+CACHE = completion_cache.from_env()  # set COMPLETION_CACHE_PATH to replay earlier completions
 
 def norm(s): return re.sub(r"\s+"," ", s.lower().strip())
 def sig_text(s): return hashlib.sha256(norm(s).encode()).hexdigest()
@@ -43,11 +47,15 @@ def ollama_chat(model, host, messages, temperature=0.7, top_p=0.9, seed=None):
     }
     if seed is not None:
         payload["options"]["seed"] = seed
+    if CACHE is not None:
+        return CACHE.get_or_call(lambda: _post_chat(host, payload), api="/api/chat", payload=payload, sample=0)
+    return _post_chat(host, payload)
 
+def _post_chat(host, payload):
     import time
     for attempt in range(4):  # retry up to 4 times
         try:
-            r = requests.post(f"{host.rstrip('/')}/api/chat", json=payload, timeout=600)
+            r = ollama_client.post(host, "/api/chat", payload, timeout=600)
             r.raise_for_status()
             try:
                 data = r.json()
@@ -170,10 +178,14 @@ def main():
     ap.add_argument("--similarity", type=float, default=0.80)
     ap.add_argument("--owl_drop_rate", type=float, default=0.25)
     ap.add_argument("--model", default="mistral")
-    ap.add_argument("--host", default=os.getenv("OLLAMA_HOST","http://localhost:11434"))
+    ap.add_argument("--host", default=os.getenv("OLLAMA_HOST","http://localhost:11434"),
+                    help="Ollama URL, or several comma-separated URLs to spread requests across")
     ap.add_argument("--batch", type=int, default=40)       # how many to request per call
     ap.add_argument("--max_calls", type=int, default=10)   # safety cap
+    ap.add_argument("--seed", type=int, default=None,
+                    help="seed the style/temperature sampling, so a rerun replays its completions from the cache")
     args=ap.parse_args()
+    random.seed(args.seed)
 
     # load base, set id continuation
     base=[]
@@ -227,6 +239,8 @@ def main():
 
     Path(args.out).write_text("\n".join(json.dumps(x, ensure_ascii=False) for x in out))
     print(f"generated={len(out)}  wrote={args.out}  calls={calls}")
+    if CACHE is not None:
+        print(f"completion cache: {CACHE.stats()}")
 
 if __name__=="__main__":
     main()
@@ -1,7 +1,13 @@
 import json, random, sys, time, os, requests
 from pathlib import Path
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import ollama_client
+import completion_cache
+CACHE = completion_cache.from_env()  # set COMPLETION_CACHE_PATH to replay earlier completions
 
 inp, outp, k, backend, model = sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4], sys.argv[5]
+# optional 6th argument: seed for row and style selection, so a rerun replays its completions from the cache
+random.seed(int(sys.argv[6]) if len(sys.argv) > 6 else None)
 rows = [json.loads(l) for l in Path(inp).read_text().splitlines() if l.strip()]
 idxs = random.sample(range(len(rows)), min(k, len(rows)))
 
@@ -24,12 +30,15 @@ def chat_openai(prompt, temperature=0.5):
 
 def chat_ollama(prompt, temperature=0.5):
     host = os.getenv("OLLAMA_HOST", "http://localhost:11434")
-    url = f"{host}/api/chat"
     j = {"model": model, "messages":[{"role":"user","content":prompt}],
          "options":{"temperature":temperature}}
-    r = requests.post(url, json=j, timeout=60)
-    r.raise_for_status()
-    return r.json()["message"]["content"].strip()
+    def call():
+        r = ollama_client.post(host, "/api/chat", j, timeout=60)
+        r.raise_for_status()
+        return r.json()["message"]["content"].strip()
+    if CACHE is not None:
+        return CACHE.get_or_call(call, api="/api/chat", payload=j, sample=0)
+    return call()
 
 def para(text):
     style = random.choice(STYLE_PROMPTS)
@@ -46,3 +55,5 @@ for i in idxs:
 with open(outp,"w") as f:
     for r in rows: f.write(json.dumps(r, ensure_ascii=False)+"\n")
 print(f"paraphrased={len(idxs)} -> {outp}")
+if CACHE is not None:
+    print(f"completion cache: {CACHE.stats()}")
@@ -0,0 +1,130 @@
+"""
+Adaptive request sizing for the generation loop.
+
+The keep-rate of generated instructions falls as the corpus saturates, so a batch size and prompt composition that
+were right at the start of a run waste requests later on. `AdaptiveBatchController` measures accepted instructions
+per second over a window of requests and hill-climbs `request_batch_size` and `num_prompt_instructions` within the
+configured bounds: a step that raised throughput is repeated, one that lowered it is undone and the direction
+reversed. The two knobs are tuned in turn, and every decision is printed and kept in `decisions`.
+"""
+import threading
+import time
+
+
+class AdaptiveBatchController(object):
+    """Tunes the request batch size and the number of in-context seed instructions for accepted throughput.
+
+    Args:
+        batch_size: Initial number of prompts per request.
+        num_prompt_instructions: Initial number of seed instructions per prompt.
+        batch_size_bounds: (min, max) for the batch size.
+        prompt_instructions_bounds: (min, max) for the number of seed instructions per prompt.
+        window: Number of finished requests measured before each decision.
+        tolerance: Relative change in throughput that counts as an improvement or a regression.
+    """
+
+    KNOBS = ("batch_size", "num_prompt_instructions")
+
+    def __init__(
+        self,
+        batch_size,
+        num_prompt_instructions,
+        batch_size_bounds=(1, 20),
+        prompt_instructions_bounds=(1, 5),
+        window=4,
+        tolerance=0.05,
+    ):
+        self.values = {"batch_size": batch_size, "num_prompt_instructions": num_prompt_instructions}
+        self.bounds = {
+            "batch_size": tuple(batch_size_bounds),
+            "num_prompt_instructions": tuple(prompt_instructions_bounds),
+        }
+        for knob in self.KNOBS:
+            low, high = self.bounds[knob]
+            self.values[knob] = min(max(self.values[knob], low), high)
+        self.window = window
+        self.tolerance = tolerance
+        self.decisions = []
+        self._lock = threading.Lock()
+        self._knob = 0
+        self._direction = {"batch_size": 1, "num_prompt_instructions": -1}
+        self._baseline = None
+        self._last_step = 0
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_start = time.time()
+        self._requests = self._generated = self._kept = 0
+
+    @property
+    def batch_size(self):
+        return self.values["batch_size"]
+
+    @property
+    def num_prompt_instructions(self):
+        return self.values["num_prompt_instructions"]
+
+    def observe(self, generated, kept):
+        """Record one finished request that produced `generated` valid instructions of which `kept` were accepted."""
+        with self._lock:
+            self._requests += 1
+            self._generated += generated
+            self._kept += kept
+            if self._requests >= self.window:
+                self._decide()
+                self._reset_window()
+
+    def _decide(self):
+        elapsed = max(time.time() - self._window_start, 1e-6)
+        throughput = self._kept / elapsed
+        knob = self.KNOBS[self._knob]
+        previous = self._baseline
+        if previous is not None and throughput <= previous * (1 - self.tolerance):
+            # the last step hurt: undo it and measure there again (the keep-rate drifts, so the old baseline goes
+            # stale) before probing the other knob; this knob goes the other way next time
+            self.values[knob] -= self._last_step
+            self._direction[knob] = -self._direction[knob]
+            self._knob = (self._knob + 1) % len(self.KNOBS)
+            self._baseline = None
+            self._last_step = 0
+            self._log(throughput, elapsed, "revert", knob)
+            return
+        if previous is None:
+            action = "explore"
+        elif throughput >= previous * (1 + self.tolerance):
+            action = "keep going"
+        else:
+            action = "no change"
+            self._knob = (self._knob + 1) % len(self.KNOBS)
+            knob = self.KNOBS[self._knob]
+        self._baseline = throughput
+        low, high = self.bounds[knob]
+        step = self._direction[knob]
+        if not low <= self.values[knob] + step <= high:
+            self._direction[knob] = step = -step
+        if not low <= self.values[knob] + step <= high:
+            step = 0
+        self.values[knob] += step
+        self._last_step = step
+        self._log(throughput, elapsed, action, knob)
+
+    def _log(self, throughput, elapsed, action, knob):
+        decision = {
+            "time": time.time(),
+            "requests": self._requests,
+            "generated": self._generated,
+            "kept": self._kept,
+            "keep_rate": self._kept / self._generated if self._generated else 0.0,
+            "kept_per_second": throughput,
+            "kept_per_request": self._kept / self._requests,
+            "action": action,
+            "tuning": knob,
+            "batch_size": self.batch_size,
+            "num_prompt_instructions": self.num_prompt_instructions,
+        }
+        self.decisions.append(decision)
+        print(
+            f"Adaptive batching: kept {self._kept}/{self._generated} in {elapsed:.1f}s ({throughput:.2f}/s), "
+            f"{action} {knob}; next batch_size={self.batch_size}, "
+            f"num_prompt_instructions={self.num_prompt_instructions}"
+        )
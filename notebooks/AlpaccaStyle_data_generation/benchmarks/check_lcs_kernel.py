@@ -0,0 +1,70 @@
+"""
+Equivalence check of the bit-parallel LCS kernel against rouge_score.
+
+Scores random queries against a random corpus with `BitParallelLcs.fmeasure` and with
+`rouge_scorer._score_lcs(query, entry).fmeasure`, and reports every pair where they differ. Tokens are drawn
+from a small vocabulary, so long common subsequences are frequent, and query lengths go well past one 64-bit word
+so the carry between words is exercised. Half of the queries score a random subset of rows. Exits with status 1 if
+any pair differs.
+
+run:
+python benchmarks/check_lcs_kernel.py --corpus_size 200 --num_queries 50 --max_len 150
+"""
+import argparse
+import random
+import sys
+from pathlib import Path
+
+from rouge_score import rouge_scorer
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from lcs_kernel import BitParallelLcs, TokenVocab
+
+
+def random_tokens(rng, vocab_size, max_len):
+    return [f"w{rng.randrange(vocab_size)}" for _ in range(rng.randint(0, max_len))]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--corpus_size", type=int, default=200)
+    ap.add_argument("--num_queries", type=int, default=50)
+    ap.add_argument("--max_len", type=int, default=150, help="maximum tokens per corpus entry and query")
+    ap.add_argument("--vocab_size", type=int, default=30)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--tolerance", type=float, default=1e-12)
+    args = ap.parse_args()
+
+    rng = random.Random(args.seed)
+    vocab = TokenVocab()
+    kernel = BitParallelLcs()
+    corpus = [random_tokens(rng, args.vocab_size, args.max_len) for _ in range(args.corpus_size)]
+    for tokens in corpus:
+        kernel.add(vocab.encode(tokens))
+
+    mismatches = pairs = long_queries = 0
+    for q in range(args.num_queries):
+        query = random_tokens(rng, args.vocab_size, args.max_len)
+        long_queries += len(query) > 64
+        rows = None
+        if q % 2:
+            rows = sorted(rng.sample(range(args.corpus_size), rng.randint(1, args.corpus_size)))
+        scores = kernel.fmeasure(vocab.encode(query), rows)
+        for row, score in zip(range(args.corpus_size) if rows is None else rows, scores):
+            expected = rouge_scorer._score_lcs(query, corpus[row]).fmeasure
+            pairs += 1
+            if abs(score - expected) > args.tolerance:
+                mismatches += 1
+                if mismatches <= 10:
+                    print(
+                        f"query {q} ({len(query)} tokens) vs entry {row} ({len(corpus[row])} tokens): "
+                        f"kernel {score!r}, rouge_score {expected!r}"
+                    )
+
+    print(f"checked {pairs} pairs ({long_queries} of {args.num_queries} queries longer than 64 tokens)")
+    print(f"mismatches: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
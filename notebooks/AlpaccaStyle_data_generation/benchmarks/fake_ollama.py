@@ -0,0 +1,323 @@
+"""
+Local stand-in for an Ollama (or OpenAI-compatible) server, for offline benchmarks.
+
+Speaks /api/generate (plain and streamed), /api/chat, /api/tags and /v1/chat/completions. Responses are built from
+a corpus of canned instructions: /api/generate continues a self-instruct prompt with `###`-delimited instructions
+up to number 19, /api/chat answers with JSONL seed tasks (or echoes the text of a paraphrase request). Timing is
+simulated: a sampled first-token latency, prompt evaluation and decoding at fixed token rates, and at most
+`num_parallel` requests decoding at once, like OLLAMA_NUM_PARALLEL. Every request draws from an RNG seeded by the
+server seed, the prompt and how often that prompt was seen, so a run is repeatable even with concurrent requests.
+
+run:
+python benchmarks/fake_ollama.py --port 11434 --latency lognormal:-1.5:0.5 --tokens_per_second 80
+"""
+import argparse
+import collections
+import hashlib
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / "seed_tasks.jsonl"
+
+
+def load_corpus(path):
+    """Load (instruction, input, output) triples from a seed-task JSONL file or a regen.json-style JSON list."""
+    text = Path(path).read_text(encoding="utf-8")
+    if text.lstrip().startswith("["):
+        rows = json.loads(text)
+    else:
+        rows = [json.loads(l) for l in text.splitlines() if l.strip()]
+    corpus = []
+    for r in rows:
+        if "instances" in r:
+            instance = r["instances"][0] if r["instances"] else {}
+            corpus.append((r["instruction"], instance.get("input", ""), instance.get("output", "")))
+        else:
+            corpus.append((r["instruction"], r.get("input", ""), r.get("output", "")))
+    return corpus
+
+
+def parse_latency(spec):
+    """Parse a latency distribution: "fixed:S", "uniform:LOW:HIGH" or "lognormal:MU:SIGMA" (seconds)."""
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda rng: args[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(args[0], args[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def count_tokens(text):
+    # close enough to a BPE count for timing purposes: about 4 characters per token
+    return max(1, math.ceil(len(text) / 4))
+
+
+class FakeModel(object):
+    """Builds canned responses and simulates how long a real server would take to produce them.
+
+    Args:
+        corpus: (instruction, input, output) triples the responses are drawn from.
+        latency: Distribution of the time to first token, see `parse_latency`.
+        tokens_per_second: Decode rate of one request.
+        prompt_tokens_per_second: Prompt evaluation rate.
+        num_parallel: Requests decoded at once; further requests wait for a free slot.
+        mutate_rate: Fraction of words in a canned instruction replaced by words from other instructions, so
+            responses are not all verbatim duplicates of the corpus.
+        load_seconds: Model load time paid by the first request, like a cold start.
+        seed: Seed of the per-request RNGs.
+    """
+
+    def __init__(
+        self,
+        corpus,
+        latency="fixed:0",
+        tokens_per_second=0,
+        prompt_tokens_per_second=0,
+        num_parallel=4,
+        mutate_rate=0.3,
+        load_seconds=0.0,
+        seed=0,
+    ):
+        self.corpus = corpus
+        self.latency = parse_latency(latency)
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.mutate_rate = mutate_rate
+        self.load_seconds = load_seconds
+        self.seed = seed
+        self.words = [w for inst, _, _ in corpus for w in inst.split()]
+        self._lock = threading.Lock()
+        self._seen = collections.Counter()
+        self._slots = threading.Semaphore(num_parallel)
+        self.requests = 0
+
+    def request_rng(self, prompt):
+        """A fresh RNG for one request, determined by the seed, the prompt and how often it was seen before."""
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            self.requests += 1
+            occurrence = self._seen[digest]
+            self._seen[digest] += 1
+        return random.Random(f"{self.seed}:{digest}:{occurrence}")
+
+    def _sample(self, rng):
+        inst, input, output = rng.choice(self.corpus)
+        words = [rng.choice(self.words) if rng.random() < self.mutate_rate else w for w in inst.split()]
+        return " ".join(words), input, output
+
+    def complete(self, prompt, rng):
+        """Continue a self-instruct prompt ending in "N. Instruction:" with instructions N..19."""
+        found = re.findall(r"(\d+)\. Instruction:\s*$", prompt)
+        start = int(found[-1]) if found else 1
+        blocks = []
+        for idx in range(start, 20):
+            inst, input, output = self._sample(rng)
+            head = " " if idx == start else f"\n###\n{idx}. Instruction: "
+            blocks.append(f"{head}{inst}\n{idx}. Input:\n{input or '<noinput>'}\n{idx}. Output:\n{output}")
+        # a real model would go on with "\n20. Instruction:", which is a stop sequence
+        return "".join(blocks) + "\n###"
+
+    def chat(self, messages, rng):
+        content = messages[-1]["content"] if messages else ""
+        if "Text:" in content:
+            # paraphrase requests (paraphrase_jsonl.py) get their text back
+            return content.split("Text:", 1)[1].strip()
+        found = re.search(r"Generate (\d+)", content)
+        rows = []
+        for _ in range(int(found.group(1)) if found else 5):
+            inst, input, _ = self._sample(rng)
+            rows.append(
+                json.dumps(
+                    {
+                        "instruction": inst,
+                        "instances": [{"input": input}],
+                        "category": "benchmark",
+                        "is_classification": False,
+                    }
+                )
+            )
+        return "\n".join(rows)
+
+    def run(self, rng, prompt_text, text, num_predict=None, on_chunk=None):
+        """Simulate generating `text` for a prompt, calling `on_chunk(piece)` as it is decoded.
+
+        Returns (text, done_reason, stats) after truncating `text` to `num_predict` tokens, where `stats` holds
+        Ollama's token counts and durations in nanoseconds.
+        """
+        done_reason = "stop"
+        if num_predict is not None and num_predict >= 0 and count_tokens(text) > num_predict:
+            text = text[: num_predict * 4]
+            done_reason = "length"
+        stats = {"prompt_eval_count": count_tokens(prompt_text), "eval_count": count_tokens(text)}
+        start = time.time()
+        with self._slots:
+            with self._lock:
+                load_seconds, self.load_seconds = self.load_seconds, 0.0
+            time.sleep(load_seconds + self.latency(rng))
+            stats["load_duration"] = int(load_seconds * 1e9)
+            prompt_seconds = 0.0
+            if self.prompt_tokens_per_second:
+                prompt_seconds = stats["prompt_eval_count"] / self.prompt_tokens_per_second
+                time.sleep(prompt_seconds)
+            stats["prompt_eval_duration"] = int(prompt_seconds * 1e9)
+            decode_start = time.time()
+            pieces = [text[i : i + 64] for i in range(0, len(text), 64)] or [""]
+            for piece in pieces:
+                if self.tokens_per_second:
+                    time.sleep(count_tokens(piece) / self.tokens_per_second)
+                if on_chunk is not None:
+                    on_chunk(piece)
+            stats["eval_duration"] = int((time.time() - decode_start) * 1e9)
+        stats["total_duration"] = int((time.time() - start) * 1e9)
+        return text, done_reason, stats
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    model = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, obj, status=200):
+        body = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "fake"}]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        options = request.get("options", {})
+        if self.path == "/api/generate":
+            prompt = request.get("prompt", "")
+            rng = self.model.request_rng(prompt)
+            text = self.model.complete(prompt, rng)
+        elif self.path == "/api/chat" or self.path == "/v1/chat/completions":
+            prompt = "\n".join(m.get("content", "") for m in request.get("messages", []))
+            rng = self.model.request_rng(prompt)
+            text = self.model.chat(request.get("messages", []), rng)
+        else:
+            self._send_json({"error": "not found"}, status=404)
+            return
+        num_predict = options.get("num_predict", request.get("max_tokens"))
+        model_name = request.get("model", "fake")
+
+        if self.path == "/v1/chat/completions":
+            text, done_reason, stats = self.model.run(rng, prompt, text, num_predict)
+            self._send_json(
+                {
+                    "object": "chat.completion",
+                    "model": model_name,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": text},
+                            "finish_reason": done_reason,
+                        }
+                    ],
+                    "usage": {"prompt_tokens": stats["prompt_eval_count"], "completion_tokens": stats["eval_count"]},
+                }
+            )
+            return
+
+        def message(piece):
+            if self.path == "/api/chat":
+                return {"model": model_name, "message": {"role": "assistant", "content": piece}}
+            return {"model": model_name, "response": piece}
+
+        if request.get("stream", True):
+            # Ollama streams NDJSON; chunked encoding keeps the connection reusable
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_chunk(obj):
+                data = (json.dumps(obj) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                _, done_reason, stats = self.model.run(
+                    rng, prompt, text, num_predict, on_chunk=lambda piece: write_chunk(dict(message(piece), done=False))
+                )
+                write_chunk(dict(message(""), done=True, done_reason=done_reason, **stats))
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                # the client cancelled the stream
+                self.close_connection = True
+            return
+
+        text, done_reason, stats = self.model.run(rng, prompt, text, num_predict)
+        self._send_json(dict(message(text), done=True, done_reason=done_reason, **stats))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients hang up on cancelled streams and idle keep-alive connections; that is not an error here
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def start_server(model, host="127.0.0.1", port=0):
+    """Serve `model` from a background thread. Returns (server, base_url); stop it with `server.shutdown()`."""
+    handler = type("FakeOllamaHandler", (_Handler,), {"model": model})
+    server = _Server((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--corpus", default=str(DEFAULT_CORPUS), help="seed-task JSONL or regen.json to draw from")
+    ap.add_argument("--latency", default="fixed:0", help="fixed:S | uniform:LOW:HIGH | lognormal:MU:SIGMA")
+    ap.add_argument("--tokens_per_second", type=float, default=0, help="decode rate per request (0 = instant)")
+    ap.add_argument("--prompt_tokens_per_second", type=float, default=0, help="prompt evaluation rate (0 = instant)")
+    ap.add_argument("--num_parallel", type=int, default=4)
+    ap.add_argument("--mutate_rate", type=float, default=0.3)
+    ap.add_argument("--load_seconds", type=float, default=0.0, help="cold-start model load time")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    model = FakeModel(
+        load_corpus(args.corpus),
+        latency=args.latency,
+        tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        num_parallel=args.num_parallel,
+        mutate_rate=args.mutate_rate,
+        load_seconds=args.load_seconds,
+        seed=args.seed,
+    )
+    server, url = start_server(model, args.host, args.port)
+    print(f"Fake Ollama server listening on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Import-time benchmark for the data-generation entry points.
+
+Every entry point is imported in a fresh interpreter under `python -X importtime`. For each one the script reports
+the cumulative import time of the module (itself and everything it pulls in, excluding interpreter startup), the
+wall time of the whole interpreter run, and the heaviest of its direct imports. The minimum over `--repeat` runs
+is reported, so a cold disk cache does not skew the numbers.
+
+run:
+python benchmarks/import_time.py --repeat 5
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+ENTRY_POINTS = [
+    "utils",
+    "generate_instruction",
+    "sharded_generation",
+    "weight_diff",
+    "ollama_client",
+    "completion_cache",
+]
+
+
+def import_time(module):
+    """One `-X importtime` run. Returns (import seconds, wall seconds, {direct import: seconds}) or an error."""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode:
+        return proc.stderr.strip().splitlines()[-1]
+    # a module's imports are listed before it, indented one level deeper
+    children, total = {}, 0.0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            children[name.strip()] = int(cumulative) / 1e6
+        elif depth == 0:
+            if name.strip() == module:
+                total = int(cumulative) / 1e6
+                break
+            children = {}
+    return total, wall, children
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--modules", default=",".join(ENTRY_POINTS))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--top", type=int, default=3, help="number of heaviest direct imports to show")
+    ap.add_argument("--output", default=None, help="write the results to this JSON file")
+    args = ap.parse_args()
+
+    baseline = min(import_time("sys")[1] for _ in range(args.repeat))
+    results = []
+    print(f"interpreter startup: {baseline * 1000:.0f} ms\n")
+    print(f"{'module':<22} {'import ms':>10} {'wall ms':>9}  heaviest imports")
+    for module in args.modules.split(","):
+        runs = [import_time(module) for _ in range(args.repeat)]
+        if isinstance(runs[0], str):
+            print(f"{module:<22} {'failed':>10} {'':>9}  {runs[0]}")
+            results.append({"module": module, "error": runs[0]})
+            continue
+        total, _, children = min(runs, key=lambda run: run[0])
+        heaviest = sorted(children.items(), key=lambda item: -item[1])[: args.top]
+        print(
+            f"{module:<22} {total * 1000:>10.1f} {min(run[1] for run in runs) * 1000:>9.0f}  "
+            + ", ".join(f"{name} {seconds * 1000:.0f}" for name, seconds in heaviest)
+        )
+        results.append(
+            {
+                "module": module,
+                "import_seconds": total,
+                "wall_seconds": min(run[1] for run in runs),
+                "heaviest_imports": dict(heaviest),
+            }
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"interpreter_startup_seconds": baseline, "entry_points": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Throughput benchmarks for the self-instruct pipeline, run against the local fake Ollama server.
+
+Every scenario drives the real `generate_instruction_following_data` (or a seed script) end to end against
+`fake_ollama.py`, started in-process with the requested latency and token rates. For each scenario it reports
+wall time, accepted instructions per second, and the time spent in ROUGE dedup and in checkpoint/cache I/O. The
+RNGs are seeded, so repeated runs send the same prompts and get the same responses.
+
+run:
+python benchmarks/run_benchmarks.py --num_instructions 100 --latency fixed:0.05 --tokens_per_second 2000
+"""
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import fake_ollama
+import generate_instruction
+import minhash_dedup
+import regen_log
+import response_archive
+import token_cache
+from rouge_dedup import RougeScoringPool
+
+SCENARIOS = {
+    "sequential": {},
+    "concurrent": {"max_in_flight": 5},
+    "pipelined": {"max_in_flight": 5, "pipeline_depth": 2},
+    "streaming": {"stream": True, "pipeline_depth": 2},
+    "minhash": {"max_in_flight": 5, "pipeline_depth": 2, "dedup_mode": "minhash"},
+    "bandit": {"max_in_flight": 5, "pipeline_depth": 2, "seed_sampling": "bandit", "seed_sampler_seed": 0},
+}
+
+# (owner, attribute) pairs whose time is attributed to each stage
+STAGES = {
+    "dedup": [
+        (RougeScoringPool, "score_batch"),
+        (RougeScoringPool, "exceeds"),
+        (RougeScoringPool, "score"),
+        (RougeScoringPool, "add"),
+        (minhash_dedup.MinHashLshIndex, "filter_batch"),
+        (minhash_dedup.MinHashLshIndex, "exceeds"),
+        (minhash_dedup.MinHashLshIndex, "add"),
+    ],
+    "io": [
+        (regen_log.RegenLog, "append"),
+        (regen_log.RegenLog, "close"),
+        (regen_log, "compact"),
+        (token_cache, "load_or_tokenize"),
+        (token_cache, "save"),
+        (response_archive.ResponseArchive, "append"),
+    ],
+}
+
+
+@contextlib.contextmanager
+def stage_timers():
+    """Accumulate the wall time spent in each stage's functions while the context is active."""
+    totals = {stage: 0.0 for stage in STAGES}
+    originals = []
+
+    def timed(stage, fn):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                totals[stage] += time.perf_counter() - start
+
+        return wrapper
+
+    for stage, targets in STAGES.items():
+        for owner, name in targets:
+            fn = getattr(owner, name)
+            originals.append((owner, name, fn))
+            setattr(owner, name, timed(stage, fn))
+    try:
+        yield totals
+    finally:
+        for owner, name, fn in originals:
+            setattr(owner, name, fn)
+
+
+def run_generation(name, url, args, **overrides):
+    os.environ["OLLAMA_HOST"] = url
+    with tempfile.TemporaryDirectory() as output_dir, stage_timers() as totals:
+        start = time.perf_counter()
+        generate_instruction.generate_instruction_following_data(
+            output_dir=output_dir,
+            seed_tasks_path=str(ROOT / "auto_seed_generation" / "seed_tasks_for_gen.jsonl"),
+            num_instructions_to_generate=args.num_instructions,
+            model_name="fake",
+            num_cpus=args.num_cpus,
+            seed=args.seed,
+            **overrides,
+        )
+        wall = time.perf_counter() - start
+        accepted = len(regen_log.load(os.path.join(output_dir, "regen.jsonl")))
+    return {
+        "scenario": name,
+        "wall_seconds": wall,
+        "accepted": accepted,
+        "accepted_per_second": accepted / wall,
+        "dedup_seconds": totals["dedup"],
+        "io_seconds": totals["io"],
+    }
+
+
+def run_seed_script(url, args):
+    env = dict(os.environ, OLLAMA_HOST=url)
+    env.pop("COMPLETION_CACHE_PATH", None)
+    with tempfile.TemporaryDirectory() as tmp:
+        out = os.path.join(tmp, "seeds.jsonl")
+        start = time.perf_counter()
+        subprocess.run(
+            [
+                sys.executable,
+                str(ROOT / "auto_seed_generation" / "gen_owl_seeds_ollama_only.py"),
+                "--base",
+                str(ROOT / "seed_tasks.jsonl"),
+                "--out",
+                out,
+                "--target",
+                "40",
+                "--batch",
+                "12",
+                "--max_calls",
+                "10",
+            ],
+            env=env,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+        wall = time.perf_counter() - start
+        accepted = sum(1 for line in open(out) if line.strip())
+    return {
+        "scenario": "seed_script",
+        "wall_seconds": wall,
+        "accepted": accepted,
+        "accepted_per_second": accepted / wall,
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--scenarios", default=",".join(list(SCENARIOS) + ["seed_script"]))
+    ap.add_argument("--num_instructions", type=int, default=100)
+    ap.add_argument("--num_cpus", type=int, default=4)
+    ap.add_argument("--corpus", default=str(fake_ollama.DEFAULT_CORPUS))
+    ap.add_argument("--latency", default="fixed:0.05")
+    ap.add_argument("--tokens_per_second", type=float, default=2000)
+    ap.add_argument("--prompt_tokens_per_second", type=float, default=2000)
+    ap.add_argument("--num_parallel", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--output", default=None, help="write the results to this JSON file")
+    args = ap.parse_args()
+    os.environ.pop("COMPLETION_CACHE_PATH", None)
+    # generate_instruction reads prompt.txt relative to the working directory
+    os.chdir(ROOT)
+
+    results = []
+    for name in args.scenarios.split(","):
+        # a fresh server per scenario, so every scenario sees the same responses
+        model = fake_ollama.FakeModel(
+            fake_ollama.load_corpus(args.corpus),
+            latency=args.latency,
+            tokens_per_second=args.tokens_per_second,
+            prompt_tokens_per_second=args.prompt_tokens_per_second,
+            num_parallel=args.num_parallel,
+            seed=args.seed,
+        )
+        server, url = fake_ollama.start_server(model)
+        try:
+            if name == "seed_script":
+                results.append(run_seed_script(url, args))
+            else:
+                results.append(run_generation(name, url, args, **SCENARIOS[name]))
+        finally:
+            server.shutdown()
+
+    print(f"\n{'scenario':<12} {'wall s':>8} {'accepted':>9} {'acc/s':>8} {'dedup s':>8} {'io s':>8}")
+    for r in results:
+        print(
+            f"{r['scenario']:<12} {r['wall_seconds']:>8.2f} {r['accepted']:>9} {r['accepted_per_second']:>8.2f} "
+            f"{r.get('dedup_seconds', float('nan')):>8.2f} {r.get('io_seconds', float('nan')):>8.2f}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
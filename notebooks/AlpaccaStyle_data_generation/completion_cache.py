@@ -0,0 +1,142 @@
+"""
+Content-addressed, size-bounded on-disk cache for LLM completions.
+
+Entries are keyed by a sha256 over everything that determines a sample (endpoint, model, prompt or messages,
+temperature, top_p, max_tokens, stop, sampling seed and sample index) plus how many times the same request has
+already been made through this cache in the current run. A prompt sent twice in one run therefore gets two
+independent samples, and re-running a script with the same seeds and decoding arguments replays earlier
+completions, in order, instead of calling the model again. The cache is a
+single sqlite file; once it grows past `max_bytes` the least recently used entries are evicted.
+
+Scripts that do not take a cache argument pick it up from the environment:
+    COMPLETION_CACHE_PATH: location of the sqlite file (caching is off when unset).
+    COMPLETION_CACHE_MAX_MB: size bound in MiB (default 1024).
+"""
+import collections
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def make_key(**fields):
+    """Hash the fields that identify one completion sample."""
+    blob = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class CompletionCache(object):
+    """A persistent LRU cache of JSON-serializable completions.
+
+    Args:
+        path: sqlite file backing the cache.
+        max_bytes: Evict least recently used entries once the stored values exceed this many bytes.
+    """
+
+    def __init__(self, path, max_bytes=1 << 30):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._occurrences = collections.Counter()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS completions_lru ON completions (last_access)")
+        self._db.commit()
+        self._total_bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+
+    def get(self, key):
+        """The cached value for `key`, or None on a miss."""
+        with self._lock:
+            row = self._db.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE completions SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        blob = json.dumps(value, ensure_ascii=False)
+        size = len(blob.encode("utf-8"))
+        with self._lock:
+            old = self._db.execute("SELECT size FROM completions WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO completions (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, blob, size, time.time()),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._db.commit()
+
+    def get_or_call(self, fn, **key_fields):
+        """Return the cached completion for `key_fields`, calling `fn()` and storing its result on a miss.
+
+        The n-th identical request in this run maps to its own entry, so repeats draw fresh samples.
+        """
+        request_key = make_key(**key_fields)
+        with self._lock:
+            occurrence = self._occurrences[request_key]
+            self._occurrences[request_key] += 1
+        key = make_key(**key_fields, occurrence=occurrence)
+        value = self.get(key)
+        if value is None:
+            value = fn()
+            self.put(key, value)
+        return value
+
+    def _evict(self):
+        while self._total_bytes > self.max_bytes:
+            rows = self._db.execute(
+                "SELECT key, size FROM completions ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self._total_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_env_caches = {}
+
+
+def from_env():
+    """The process-wide cache configured by COMPLETION_CACHE_PATH / COMPLETION_CACHE_MAX_MB, or None if unset."""
+    path = os.getenv("COMPLETION_CACHE_PATH")
+    if not path:
+        return None
+    if path not in _env_caches:
+        max_bytes = int(float(os.getenv("COMPLETION_CACHE_MAX_MB", "1024")) * (1 << 20))
+        _env_caches[path] = CompletionCache(path, max_bytes=max_bytes)
+    return _env_caches[path]
@@ -8,22 +8,34 @@ python -m generate_instruction generate_instruction_following_data \
   --model_name="text-davinci-003" \
 """
 import time
+import collections
+import functools
 import json
+import multiprocessing
 import os
 import random
 import re
-import string
-from functools import partial
-from multiprocessing import Pool
+import threading
 
-import numpy as np
-import tqdm
-from rouge_score import rouge_scorer
+# numpy, rouge_score, tqdm and the numpy-based modules are imported by the tasks that use them, so short tasks
+# such as compact_regen_log start without loading them
+import completion_cache
+import ollama_client
+import regen_log
+import response_archive
+import telemetry
 import utils
+from batch_controller import AdaptiveBatchController
+from instruction_filter import InstructionFilter
+from pipeline import RequestPipeline
+from seed_sampler import BanditSeedSampler
 
 import fire
 
 
+DEFAULT_FILTER = InstructionFilter()
+
+
 def encode_prompt(prompt_instructions):
     """Encode multiple prompt instructions into a single string."""
     prompt = open("./prompt.txt").read() + "\n"
@@ -41,70 +53,82 @@ def encode_prompt(prompt_instructions):
     return prompt
 
 
-def post_process_gpt3_response(num_prompt_instructions, response):
+def post_process_gpt3_response(num_prompt_instructions, response, quality_filter=None):
+    instructions = []
+    for idx, inst in split_instruction_blocks(num_prompt_instructions, response):
+        instruction = parse_instruction_block(idx, inst, quality_filter)
+        if instruction is not None:
+            instructions.append(instruction)
+    return instructions
+
+
+def split_instruction_blocks(num_prompt_instructions, response):
+    """Split a completion into `(idx, raw_text)` blocks, one per `###`-delimited generated instruction."""
     if response is None:
         return []
     raw_instructions = f"{num_prompt_instructions+1}. Instruction:" + response["text"]
     raw_instructions = re.split("###", raw_instructions)
-    instructions = []
-    for idx, inst in enumerate(raw_instructions):
-        # if the decoding stops due to length, the last example is likely truncated so we discard it
-        if idx == len(raw_instructions) - 1 and response["finish_reason"] == "length":
-            continue
-        idx += num_prompt_instructions + 1
-        splitted_data = re.split(f"{idx}\.\s+(Instruction|Input|Output):", inst)
-        if len(splitted_data) != 7:
-            continue
-        else:
-            inst = splitted_data[2].strip()
-            input = splitted_data[4].strip()
-            input = "" if input.lower() == "<noinput>" else input
-            output = splitted_data[6].strip()
-        # filter out too short or too long instructions
-        if len(inst.split()) <= 3 or len(inst.split()) > 150:
-            continue
-        # filter based on keywords that are not suitable for language models.
-        blacklist = [
-            "image",
-            "images",
-            "graph",
-            "graphs",
-            "picture",
-            "pictures",
-            "file",
-            "files",
-            "map",
-            "maps",
-            "draw",
-            "plot",
-            "go to",
-            "video",
-            "audio",
-            "music",
-            "flowchart",
-            "diagram",
-        ]
-        blacklist += []
-        if any(find_word_in_string(word, inst) for word in blacklist):
-            continue
-        # We found that the model tends to add "write a program" to some existing instructions, which lead to a lot of such instructions.
-        # And it's a bit comfusing whether the model need to write a program or directly output the result.
-        # Here we filter them out.
-        # Note this is not a comprehensive filtering for all programming instructions.
-        if inst.startswith("Write a program"):
-            continue
-        # filter those starting with punctuation
-        if inst[0] in string.punctuation:
-            continue
-        # filter those starting with non-english character
-        if not inst[0].isascii():
-            continue
-        instructions.append({"instruction": inst, "input": input, "output": output})
-    return instructions
+    # if the decoding stops due to length, the last example is likely truncated so we discard it
+    if response["finish_reason"] == "length":
+        raw_instructions = raw_instructions[:-1]
+    return [(idx + num_prompt_instructions + 1, inst) for idx, inst in enumerate(raw_instructions)]
+
+
+class InstructionBlockStream(object):
+    """Incremental `split_instruction_blocks` for a streamed completion: blocks are returned once complete."""
+
+    def __init__(self, num_prompt_instructions):
+        self.buffer = f"{num_prompt_instructions+1}. Instruction:"
+        self.next_idx = num_prompt_instructions + 1
+
+    def feed(self, text):
+        *complete, self.buffer = (self.buffer + text).split("###")
+        blocks = [(self.next_idx + i, inst) for i, inst in enumerate(complete)]
+        self.next_idx += len(complete)
+        return blocks
+
+    def finish(self, finish_reason):
+        # as in `split_instruction_blocks`, a tail cut off by the length limit is discarded
+        return [] if finish_reason == "length" else [(self.next_idx, self.buffer)]
+
+
+@functools.lru_cache(maxsize=64)
+def _block_pattern(idx):
+    return re.compile(rf"{idx}\.\s+(Instruction|Input|Output):")
+
+
+def parse_instruction_block(idx, inst, quality_filter=None):
+    """Parse and filter one generated block. Returns the instruction dict, or None if it is rejected."""
+    quality_filter = quality_filter or DEFAULT_FILTER
+    splitted_data = _block_pattern(idx).split(inst)
+    if len(splitted_data) != 7:
+        quality_filter.reject("malformed")
+        return None
+    else:
+        inst = splitted_data[2].strip()
+        input = splitted_data[4].strip()
+        input = "" if input.lower() == "<noinput>" else input
+        output = splitted_data[6].strip()
+    if not quality_filter.accept(inst):
+        return None
+    return {"instruction": inst, "input": input, "output": output}
+
+
+def summarize_similarities(rouge_scores, top=10):
+    """Metadata of an accepted instruction: its `top` most similar corpus positions with their scores, and its mean
+    score against the corpus."""
+    import numpy as np
 
+    most_similar = [[int(i), float(rouge_scores[i])] for i in np.argsort(rouge_scores)[-top:][::-1]]
+    return most_similar, float(np.mean(rouge_scores))
 
-def find_word_in_string(w, s):
-    return re.compile(r"\b({0})\b".format(w), flags=re.IGNORECASE).search(s)
+
+def load_seed_instruction_data(seed_tasks_path):
+    seed_tasks = [json.loads(l) for l in open(seed_tasks_path, "r")]
+    return [
+        {"instruction": t["instruction"], "input": t["instances"][0]["input"], "output": t["instances"][0]["output"]}
+        for t in seed_tasks
+    ]
 
 
 def generate_instruction_following_data(
@@ -117,22 +141,56 @@ def generate_instruction_following_data(
     temperature=1.0,
     top_p=1.0,
     num_cpus=16,
+    batch_dedup=True,
+    write_regen_json=True,
+    max_in_flight=1,
+    pipeline_depth=0,
+    stream=False,
+    stream_max_instructions=None,
+    completion_cache_path=None,
+    adaptive_batching=False,
+    request_batch_size_bounds=None,
+    prompt_instructions_bounds=(1, 5),
+    adaptive_window=4,
+    blacklist_path=None,
+    similarity_threshold=0.7,
+    archive_responses=True,
+    samples_per_prompt=1,
+    adaptive_max_tokens=False,
+    dedup_mode="rouge",
+    jaccard_threshold=0.4,
+    similarity_summary="exact",
+    similarity_sample_size=256,
+    seed_sampling="uniform",
+    seed_exploration=0.1,
+    seed_sampler_seed=None,
+    seed=42,
+    shutdown_timeout=10.0,
 ):
-    seed_tasks = [json.loads(l) for l in open(seed_tasks_path, "r")]
-    seed_instruction_data = [
-        {"instruction": t["instruction"], "input": t["instances"][0]["input"], "output": t["instances"][0]["output"]}
-        for t in seed_tasks
-    ]
+    import numpy as np
+    import tqdm
+    from rouge_score import rouge_scorer
+
+    import minhash_dedup
+    import token_cache
+    from rouge_dedup import RougeScoringPool
+    from token_budget import TokenBudgetEstimator
+
+    seed_instruction_data = load_seed_instruction_data(seed_tasks_path)
     print(f"Loaded {len(seed_instruction_data)} human-written seed instructions")
 
     os.makedirs(output_dir, exist_ok=True)
     request_idx = 0
-    # load the LM-generated instructions
-    machine_instruction_data = []
-    if os.path.exists(os.path.join(output_dir, "regen.json")):
-        machine_instruction_data = utils.jload(os.path.join(output_dir, "regen.json"))
+    # load the LM-generated instructions; the append-only log supersedes a legacy regen.json
+    log_path = os.path.join(output_dir, "regen.jsonl")
+    machine_instruction_data = regen_log.load_or_migrate(log_path, os.path.join(output_dir, "regen.json"))
+    if machine_instruction_data:
         print(f"Loaded {len(machine_instruction_data)} machine-generated instructions")
+    checkpoint = regen_log.RegenLog(log_path)
+    num_resumed = num_machine_instructions = len(machine_instruction_data)
+    telemetry.reset()
 
+    quality_filter = InstructionFilter.from_file(blacklist_path) if blacklist_path else InstructionFilter()
     # similarities = {}
     scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)
 
@@ -145,21 +203,101 @@ def generate_instruction_following_data(
     all_instructions = [d["instruction"] for d in seed_instruction_data] + [
         d["instruction"] for d in machine_instruction_data
     ]
-    all_instruction_tokens = [scorer._tokenizer.tokenize(inst) for inst in all_instructions]
+    # the entries themselves live in regen.jsonl; only the count is needed from here on
+    del machine_instruction_data
+    # token ids are cached next to regen.json, so a resumed run only tokenizes what is new
+    token_cache_path = os.path.join(output_dir, "regen.tokens")
+    vocab, all_instruction_ids, num_cached = token_cache.load_or_tokenize(
+        token_cache_path, all_instructions, scorer._tokenizer.tokenize
+    )
+    if num_cached:
+        print(f"Loaded token ids for {num_cached} instructions from {token_cache_path}")
+    # the texts are in the seed tasks and regen.jsonl; neighbors are referred to by their position in seeds + log
+    del all_instructions
+    # "rouge" is the exact ROUGE-L gate, "minhash" the approximate MinHash-LSH gate, and "minhash+rouge" drops
+    # MinHash near-duplicates before the exact check
+    if dedup_mode not in ("rouge", "minhash", "minhash+rouge"):
+        raise ValueError(f"Unknown dedup_mode: {dedup_mode}")
+    # "exact" scores every accepted instruction against the whole corpus for its metadata; "sampled" takes the top
+    # 10 from the pruned candidates and estimates avg_similarity_score from a stratified sample, with an error bound
+    if similarity_summary not in ("exact", "sampled"):
+        raise ValueError(f"Unknown similarity_summary: {similarity_summary}")
+    sampled_summary = similarity_summary == "sampled"
+    rouge_pool = minhash_index = None
+    if dedup_mode != "minhash":
+        # the scoring workers are started once and keep their own shard of the corpus for the whole run
+        rouge_pool = RougeScoringPool(corpus_ids=all_instruction_ids, vocab=vocab, num_workers=num_cpus)
+    if dedup_mode != "rouge":
+        minhash_index = minhash_dedup.MinHashLshIndex(threshold=jaccard_threshold, vocab=vocab)
+        for ids in all_instruction_ids:
+            minhash_index.add_ids(ids)
+    # the scoring shards hold the token ids the token cache is saved from; without them they are kept here
+    corpus_ids = all_instruction_ids if rouge_pool is None else None
+    del all_instruction_ids
+    num_prefiltered = 0
+    # completions are replayed from the cache when the same prompt is sent with the same decoding arguments
+    if completion_cache_path:
+        cache = completion_cache.CompletionCache(completion_cache_path)
+    else:
+        cache = completion_cache.from_env()
+    # raw responses are archived so parsing, filtering and dedup can be replayed without generating again
+    archive = None
+    if archive_responses:
+        archive = response_archive.ResponseArchive(os.path.join(output_dir, "raw_responses.jsonl.gz"))
+    # learns the decoded tokens per instruction; with adaptive_max_tokens it also sets max_tokens from them
+    token_budget = TokenBudgetEstimator(default_max_tokens=3072)
+    # the controller resizes requests as the keep-rate changes; its decisions are saved next to regen.json
+    controller = None
+    if adaptive_batching:
+        controller = AdaptiveBatchController(
+            request_batch_size,
+            num_prompt_instructions,
+            batch_size_bounds=request_batch_size_bounds or (1, 4 * request_batch_size),
+            prompt_instructions_bounds=prompt_instructions_bounds,
+            window=adaptive_window,
+        )
+
+    # prompts are drawn from their own RNG, so a rerun or a resumed run with the same seed sends the same prompts
+    # and is served from the completion cache up to the point where the earlier run stopped
+    rng = random.Random(seed)
+    # "bandit" learns which seed tasks lead to kept instructions; its draws follow seed_sampler_seed, or seed
+    if seed_sampling not in ("uniform", "bandit"):
+        raise ValueError(f"Unknown seed_sampling: {seed_sampling}")
+    seed_sampler = None
+    if seed_sampling == "bandit":
+        seed_sampler = BanditSeedSampler(
+            len(seed_instruction_data),
+            exploration=seed_exploration,
+            seed=seed if seed_sampler_seed is None else seed_sampler_seed,
+        )
+
+    def sample_seeds(num_prompt_instructions):
+        if seed_sampler is None:
+            return rng.sample(range(len(seed_instruction_data)), num_prompt_instructions)
+        return seed_sampler.sample(num_prompt_instructions)
+
+    def request_sizes():
+        if controller is None:
+            return request_batch_size, num_prompt_instructions
+        return controller.batch_size, controller.num_prompt_instructions
 
-    while len(machine_instruction_data) < num_instructions_to_generate:
-        request_idx += 1
+    # set when generation is done; requests still in flight watch it and abort instead of finishing
+    cancel = threading.Event()
 
-        batch_inputs = []
+    def request_round():
+        request_batch_size, num_prompt_instructions = request_sizes()
+        batch_inputs, prompt_seeds = [], []
         for _ in range(request_batch_size):
             # only sampling from the seed tasks
-            prompt_instructions = random.sample(seed_instruction_data, num_prompt_instructions)
-            prompt = encode_prompt(prompt_instructions)
+            seeds = sample_seeds(num_prompt_instructions)
+            prompt = encode_prompt([seed_instruction_data[i] for i in seeds])
             batch_inputs.append(prompt)
+            prompt_seeds.append(seeds)
         decoding_args = utils.OpenAIDecodingArguments(
             temperature=temperature,
-            n=1,
-            max_tokens=3072,  # hard-code to maximize the length. the requests will be automatically adjusted
+            n=samples_per_prompt,
+            # ask for just enough tokens for the remaining instructions (up to 20), or the maximum length
+            max_tokens=token_budget.max_tokens(19 - num_prompt_instructions) if adaptive_max_tokens else 3072,
             top_p=top_p,
             stop=["\n20", "20.", "20."],
         )
@@ -170,43 +308,316 @@ def generate_instruction_following_data(
             batch_size=request_batch_size,
             decoding_args=decoding_args,
             logit_bias={"50256": -100},  # prevent the <|endoftext|> token from being generated
+            max_in_flight=max_in_flight,
+            cache=cache,
+            cancel=cancel if pipeline_depth else None,
         )
-        request_duration = time.time() - request_start
+        if samples_per_prompt > 1:
+            results = [result for samples in results for result in samples]
+            prompt_seeds = [seeds for seeds in prompt_seeds for _ in range(samples_per_prompt)]
+        if archive is not None:
+            archive.append(
+                [{"num_prompt_instructions": num_prompt_instructions, "response": r} for r in results if r is not None]
+            )
+        blocks, sources = [], []
+        for result, seeds in zip(results, prompt_seeds):
+            result_blocks = split_instruction_blocks(num_prompt_instructions, result)
+            token_budget.observe(result, len(result_blocks))
+            blocks += result_blocks
+            sources += [seeds] * len(result_blocks)
+        yield blocks, sources, time.time() - request_start, True
+
+    def stream_round():
+        # every block is handed over as soon as it is complete, and the stream is cancelled once it has
+        # produced as many instructions as we want from one response
+        request_batch_size, num_prompt_instructions = request_sizes()
+        max_blocks = stream_max_instructions or 19 - num_prompt_instructions
+        request_start = time.time()
+        for _ in range(request_batch_size):
+            seeds = sample_seeds(num_prompt_instructions)
+            parser = InstructionBlockStream(num_prompt_instructions)
+            chunks = utils.ollama_generate_stream(
+                model_name,
+                encode_prompt([seed_instruction_data[i] for i in seeds]),
+                temperature=temperature,
+                top_p=top_p,
+                max_tokens=3072,
+                stop=["\n20", "20.", "20."],
+            )
+            num_blocks = 0
+            pieces, finish_reason = [], None
+            try:
+                for text, finish_reason in chunks:
+                    if cancel.is_set():
+                        return
+                    pieces.append(text)
+                    blocks = parser.feed(text)
+                    if finish_reason is not None:
+                        blocks += parser.finish(finish_reason)
+                    blocks = blocks[: max_blocks - num_blocks]
+                    num_blocks += len(blocks)
+                    if blocks:
+                        yield blocks, [seeds] * len(blocks), time.time() - request_start, False
+                    if num_blocks >= max_blocks:
+                        break
+            finally:
+                chunks.close()
+            if archive is not None:
+                # a cancelled stream is archived like a truncated one, so its unfinished tail is dropped on replay
+                response = {"text": "".join(pieces), "finish_reason": finish_reason or "length"}
+                record = {"num_prompt_instructions": num_prompt_instructions, "response": response}
+                archive.append([dict(record, max_instructions=max_blocks)])
+        yield [], [], time.time() - request_start, True
+
+    # with pipeline_depth > 0, producer threads keep that many requests in flight while this loop post-processes
+    rounds = RequestPipeline(stream_round if stream else request_round, depth=pipeline_depth, stop=cancel)
+
+    total = keep = 0
+    process_duration = 0.0
+    while num_machine_instructions < num_instructions_to_generate:
+        wait_start = time.time()
+        blocks, sources, request_duration, request_done = next(rounds)
+        # time the post-processing loop spent waiting for the model
+        telemetry.get().observe("pipeline_wait", time.time() - wait_start)
 
         process_start = time.time()
-        instruction_data = []
-        for result in results:
-            new_instructions = post_process_gpt3_response(num_prompt_instructions, result)
-            instruction_data += new_instructions
-
-        total = len(instruction_data)
-        keep = 0
-        for instruction_data_entry in instruction_data:
-            # computing similarity with the pre-tokenzied instructions
-            new_instruction_tokens = scorer._tokenizer.tokenize(instruction_data_entry["instruction"])
-            with Pool(num_cpus) as p:
-                rouge_scores = p.map(
-                    partial(rouge_scorer._score_lcs, new_instruction_tokens),
-                    all_instruction_tokens,
-                )
-            rouge_scores = [score.fmeasure for score in rouge_scores]
-            most_similar_instructions = {
-                all_instructions[i]: rouge_scores[i] for i in np.argsort(rouge_scores)[-10:][::-1]
-            }
-            if max(rouge_scores) > 0.7:
-                continue
+        instruction_data, candidate_seeds = [], []
+        for (idx, inst), seeds in zip(blocks, sources):
+            new_instruction = parse_instruction_block(idx, inst, quality_filter)
+            if new_instruction is not None:
+                instruction_data.append(new_instruction)
+            candidate_seeds.append((new_instruction, seeds))
+
+        total += len(instruction_data)
+        kept_entries = []
+        new_tokens = [scorer._tokenizer.tokenize(d["instruction"]) for d in instruction_data]
+        if dedup_mode == "minhash+rouge":
+            novel = [not minhash_index.exceeds(tokens) for tokens in new_tokens]
+            num_prefiltered += novel.count(False)
+            instruction_data = [d for d, is_novel in zip(instruction_data, novel) if is_novel]
+            new_tokens = [tokens for tokens, is_novel in zip(new_tokens, novel) if is_novel]
+        # in batch mode the whole round is scored at once; acceptance is still resolved in order
+        batch_scores = None
+        if dedup_mode == "minhash":
+            batch_scores = iter(minhash_index.filter_batch(new_tokens))
+        elif batch_dedup and sampled_summary:
+            batch_scores = iter(
+                rouge_pool.summarize_batch(new_tokens, similarity_threshold, sample_size=similarity_sample_size)
+            )
+        elif batch_dedup:
+            batch_scores = iter(rouge_pool.score_batch(new_tokens, similarity_threshold))
+        for instruction_data_entry, new_instruction_tokens in zip(instruction_data, new_tokens):
+            similarity_error = avg_candidate_jaccard = None
+            if dedup_mode == "minhash":
+                neighbors = next(batch_scores)
+                if neighbors is None:
+                    continue
+                # approximate neighbors, scored by estimated Jaccard similarity instead of ROUGE-L
+                positions, similarities = neighbors
+                most_similar_instructions = [[int(i), float(s)] for i, s in zip(positions, similarities)]
+                # the mean over the few LSH bucket-mates is not comparable to the corpus-wide mean ROUGE-L of the
+                # exact modes, so it gets its own key and avg_similarity_score is left out
+                avg_similarity_score = None
+                avg_candidate_jaccard = float(np.mean(similarities)) if len(similarities) else 0.0
             else:
-                keep += 1
+                if batch_dedup:
+                    rouge_scores = next(batch_scores)
+                    if rouge_scores is None:
+                        continue
+                else:
+                    # the postings index lets the gate skip the exact LCS for entries that cannot exceed the threshold
+                    if rouge_pool.exceeds(new_instruction_tokens, similarity_threshold):
+                        continue
+                    if sampled_summary:
+                        rouge_scores = rouge_pool.summarize(new_instruction_tokens, sample_size=similarity_sample_size)
+                    else:
+                        rouge_scores = rouge_pool.score(new_instruction_tokens)
+                    rouge_pool.add(new_instruction_tokens)
+                if sampled_summary:
+                    positions, top_scores, avg_similarity_score, similarity_error = rouge_scores
+                    most_similar_instructions = [[int(i), float(s)] for i, s in zip(positions, top_scores)]
+                else:
+                    most_similar_instructions, avg_similarity_score = summarize_similarities(rouge_scores)
+                if minhash_index is not None:
+                    minhash_index.add(new_instruction_tokens)
+            keep += 1
             instruction_data_entry["most_similar_instructions"] = most_similar_instructions
-            instruction_data_entry["avg_similarity_score"] = float(np.mean(rouge_scores))
-            machine_instruction_data.append(instruction_data_entry)
-            all_instructions.append(instruction_data_entry["instruction"])
-            all_instruction_tokens.append(new_instruction_tokens)
+            if avg_similarity_score is not None:
+                instruction_data_entry["avg_similarity_score"] = avg_similarity_score
+            if avg_candidate_jaccard is not None:
+                instruction_data_entry["avg_candidate_jaccard"] = avg_candidate_jaccard
+            if similarity_error is not None:
+                # half-width of the 95% confidence interval of the sampled estimate
+                instruction_data_entry["avg_similarity_score_error"] = similarity_error
+            kept_entries.append(instruction_data_entry)
+            num_machine_instructions += 1
+            if corpus_ids is not None:
+                corpus_ids.append(vocab.encode(new_instruction_tokens))
             progress_bar.update(1)
-        process_duration = time.time() - process_start
-        print(f"Request {request_idx} took {request_duration:.2f}s, processing took {process_duration:.2f}s")
-        print(f"Generated {total} instructions, kept {keep} instructions")
-        utils.jdump(machine_instruction_data, os.path.join(output_dir, "regen.json"))
+        checkpoint.append(kept_entries)
+        if seed_sampler is not None:
+            kept_ids = {id(d) for d in kept_entries}
+            for new_instruction, seeds in candidate_seeds:
+                seed_sampler.observe(seeds, id(new_instruction) in kept_ids)
+        process_duration += time.time() - process_start
+        if request_done:
+            request_idx += 1
+            print(f"Request {request_idx} took {request_duration:.2f}s, processing took {process_duration:.2f}s")
+            print(f"Generated {total} instructions, kept {keep} instructions")
+            if controller is not None:
+                controller.observe(total, keep)
+            total = keep = 0
+            process_duration = 0.0
+    # requests still in flight are cancelled; they use the archive, cache and telemetry, so the producers have to
+    # exit before those are closed
+    num_running = rounds.close(timeout=shutdown_timeout)
+    if num_running:
+        print(f"Warning: {num_running} requests still in flight after shutdown; their results are dropped")
+    if dedup_mode == "minhash+rouge":
+        print(f"MinHash prefilter dropped {num_prefiltered} near-duplicates before ROUGE-L")
+    if archive is not None:
+        archive.close()
+    if cache is not None:
+        print(f"Completion cache: {cache.stats()}")
+    print(f"Instruction filter: {quality_filter.report()}")
+    if seed_sampler is not None:
+        print(f"Seed sampler: {seed_sampler.report()}")
+    if token_budget.responses:
+        print(f"Token budget: {token_budget.report(num_machine_instructions - num_resumed)}")
+    print(f"Telemetry: {telemetry.get().summary()}")
+    telemetry.get().export(os.path.join(output_dir, "telemetry.json"))
+    if controller is not None:
+        utils.jdump(controller.decisions, os.path.join(output_dir, "batch_decisions.json"))
+    for host, stats in ollama_client.endpoint_stats().items():
+        print(f"Endpoint {host}: {stats}")
+    checkpoint.close()
+    if rouge_pool is not None:
+        corpus_ids = rouge_pool.corpus_ids()
+        rouge_pool.close()
+    corpus_texts = [d["instruction"] for d in seed_instruction_data] + [
+        d["instruction"] for d in regen_log.load(log_path)
+    ]
+    token_cache.save(token_cache_path, corpus_texts, vocab, corpus_ids)
+    if write_regen_json:
+        compact_regen_log(output_dir, seed_tasks_path)
+
+
+def _parse_archived(args):
+    from rouge_score import rouge_scorer
+
+    records, blacklist_path = args
+    quality_filter = InstructionFilter.from_file(blacklist_path) if blacklist_path else InstructionFilter()
+    tokenizer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)._tokenizer
+    parsed = []
+    for record in records:
+        blocks = split_instruction_blocks(record["num_prompt_instructions"], record["response"])
+        if record.get("max_instructions"):
+            blocks = blocks[: record["max_instructions"]]
+        instruction_data = [parse_instruction_block(idx, inst, quality_filter) for idx, inst in blocks]
+        parsed.append([(d, tokenizer.tokenize(d["instruction"])) for d in instruction_data if d is not None])
+    return parsed, quality_filter.counts
+
+
+def replay_raw_responses(
+    output_dir="./",
+    seed_tasks_path="auto_seed_generation/seed_tasks_for_gen.jsonl",
+    archive_path=None,
+    replay_path=None,
+    similarity_threshold=0.7,
+    blacklist_path=None,
+    num_cpus=16,
+    chunk_size=256,
+):
+    """Re-run parsing, filtering and ROUGE dedup over archived raw responses, without any new LLM calls.
+
+    Parsing, filtering and tokenization run in parallel over `num_cpus` processes; dedup is then applied in
+    archive order, so the result is what the generation run would have kept with these settings. It is written to
+    `replay_path` (default: replay.json in `output_dir`) and never touches regen.json.
+    """
+    import tqdm
+    from rouge_score import rouge_scorer
+
+    from rouge_dedup import RougeScoringPool
+
+    archive_path = archive_path or os.path.join(output_dir, "raw_responses.jsonl.gz")
+    replay_path = replay_path or os.path.join(output_dir, "replay.json")
+    seed_tasks = [json.loads(l) for l in open(seed_tasks_path, "r")]
+    all_instructions = [t["instruction"] for t in seed_tasks]
+    records = list(response_archive.iter_records(archive_path))
+    print(f"Loaded {len(records)} archived responses from {archive_path}")
+
+    start = time.time()
+    chunks = [(records[i : i + chunk_size], blacklist_path) for i in range(0, len(records), chunk_size)]
+    counts = collections.Counter()
+    parsed = []
+    with multiprocessing.Pool(num_cpus) as pool:
+        for chunk_parsed, chunk_counts in pool.imap(_parse_archived, chunks):
+            parsed += chunk_parsed
+            counts.update(chunk_counts)
+    print(f"Parsed {sum(map(len, parsed))} instructions in {time.time() - start:.2f}s")
+    print(f"Instruction filter: {dict(counts.most_common())}")
+
+    start = time.time()
+    scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)
+    corpus_tokens = [scorer._tokenizer.tokenize(inst) for inst in all_instructions]
+    machine_instruction_data = []
+    with RougeScoringPool(corpus_tokens, num_workers=num_cpus) as rouge_pool:
+        for response_data in tqdm.tqdm(parsed):
+            batch_scores = rouge_pool.score_batch([tokens for _, tokens in response_data], similarity_threshold)
+            for (instruction_data_entry, _), rouge_scores in zip(response_data, batch_scores):
+                if rouge_scores is None:
+                    continue
+                most_similar_instructions, avg_similarity_score = summarize_similarities(rouge_scores)
+                instruction_data_entry["most_similar_instructions"] = {
+                    all_instructions[i]: score for i, score in most_similar_instructions
+                }
+                instruction_data_entry["avg_similarity_score"] = avg_similarity_score
+                machine_instruction_data.append(instruction_data_entry)
+                all_instructions.append(instruction_data_entry["instruction"])
+    print(f"Deduplicated in {time.time() - start:.2f}s, kept {len(machine_instruction_data)} instructions")
+    utils.jdump(machine_instruction_data, replay_path)
+
+
+def minhash_agreement(
+    output_dir="./",
+    seed_tasks_path="auto_seed_generation/seed_tasks_for_gen.jsonl",
+    sample_size=200,
+    similarity_threshold=0.7,
+    jaccard_threshold=0.4,
+):
+    """Report how often the MinHash-LSH gate agrees with the exact ROUGE-L gate on a sample of the corpus."""
+    from rouge_score import rouge_scorer
+
+    import minhash_dedup
+
+    seed_tasks = [json.loads(l) for l in open(seed_tasks_path, "r")]
+    log_path = os.path.join(output_dir, "regen.jsonl")
+    if os.path.exists(log_path):
+        machine_instruction_data = regen_log.load(log_path)
+    else:
+        machine_instruction_data = utils.jload(os.path.join(output_dir, "regen.json"))
+    all_instructions = [t["instruction"] for t in seed_tasks] + [d["instruction"] for d in machine_instruction_data]
+    scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)
+    report = minhash_dedup.agreement_report(
+        [scorer._tokenizer.tokenize(inst) for inst in all_instructions],
+        rouge_threshold=similarity_threshold,
+        jaccard_threshold=jaccard_threshold,
+        sample_size=sample_size,
+    )
+    print(json.dumps(report, indent=4))
+    utils.jdump(report, os.path.join(output_dir, "minhash_agreement.json"))
+
+
+def compact_regen_log(output_dir="./", seed_tasks_path="auto_seed_generation/seed_tasks_for_gen.jsonl"):
+    """Emit the legacy regen.json from the append-only regen.jsonl log.
+
+    Neighbors are logged by corpus position, so the seed tasks the run started from are needed to spell them out.
+    """
+    seed_instructions = [json.loads(l)["instruction"] for l in open(seed_tasks_path, "r")]
+    num_entries = regen_log.compact(
+        os.path.join(output_dir, "regen.jsonl"), os.path.join(output_dir, "regen.json"), seed_instructions
+    )
+    print(f"Compacted {num_entries} machine-generated instructions into regen.json")
 
 
 def main(task, **kwargs):
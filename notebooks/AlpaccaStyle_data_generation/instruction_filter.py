@@ -0,0 +1,109 @@
+"""
+Precompiled quality filter for generated instructions.
+
+All blacklist rules are compiled into a single case-insensitive alternation with word boundaries, so an
+instruction is scanned once instead of compiling and running one regex per rule. Rules can be loaded from a text
+file (one word or phrase per line, `#` starts a comment), and every rejection is counted by reason so a run can
+report which rules are doing the work.
+"""
+import collections
+import re
+import string
+
+DEFAULT_BLACKLIST = [
+    "image",
+    "images",
+    "graph",
+    "graphs",
+    "picture",
+    "pictures",
+    "file",
+    "files",
+    "map",
+    "maps",
+    "draw",
+    "plot",
+    "go to",
+    "video",
+    "audio",
+    "music",
+    "flowchart",
+    "diagram",
+]
+
+
+def load_rules(path):
+    """Read blacklist rules from `path`: one word or phrase per line, blank lines and `#` comments ignored."""
+    rules = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            rule = line.split("#", 1)[0].strip()
+            if rule:
+                rules.append(rule)
+    return rules
+
+
+class InstructionFilter(object):
+    """Single-pass blacklist and quality checks with per-rule rejection counts.
+
+    Args:
+        blacklist: Words or phrases that reject an instruction when they occur as whole words (case-insensitive).
+        min_words: Instructions with at most this many words are rejected.
+        max_words: Instructions with more than this many words are rejected.
+    """
+
+    def __init__(self, blacklist=None, min_words=3, max_words=150):
+        self.blacklist = list(DEFAULT_BLACKLIST if blacklist is None else blacklist)
+        self.min_words = min_words
+        self.max_words = max_words
+        self._rules = {rule.lower(): rule for rule in self.blacklist}
+        self._pattern = None
+        if self.blacklist:
+            # longest rules first, so a rule that is a prefix of another cannot shadow it at the same position
+            alternation = "|".join(re.escape(rule) for rule in sorted(self.blacklist, key=len, reverse=True))
+            self._pattern = re.compile(r"\b(?:{0})\b".format(alternation), flags=re.IGNORECASE)
+        self.counts = collections.Counter()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        return cls(blacklist=load_rules(path), **kwargs)
+
+    def rejection_reason(self, inst):
+        """The reason `inst` is rejected, e.g. "blacklist:image", or None if it passes."""
+        num_words = len(inst.split())
+        # filter out too short or too long instructions
+        if num_words <= self.min_words or num_words > self.max_words:
+            return "length"
+        # filter based on keywords that are not suitable for language models.
+        if self._pattern is not None:
+            match = self._pattern.search(inst)
+            if match:
+                return "blacklist:" + self._rules.get(match.group(0).lower(), match.group(0).lower())
+        # the model tends to add "write a program" to existing instructions, which makes it unclear whether a
+        # program or the result is wanted
+        if inst.startswith("Write a program"):
+            return "write_a_program"
+        # filter those starting with punctuation
+        if inst[0] in string.punctuation:
+            return "punctuation"
+        # filter those starting with non-english character
+        if not inst[0].isascii():
+            return "non_ascii"
+        return None
+
+    def accept(self, inst):
+        """True if `inst` passes; otherwise the rejection is counted and False is returned."""
+        reason = self.rejection_reason(inst)
+        if reason is None:
+            self.counts["accepted"] += 1
+            return True
+        self.counts[reason] += 1
+        return False
+
+    def reject(self, reason):
+        """Count a rejection decided outside the filter (e.g. a block that could not be parsed)."""
+        self.counts[reason] += 1
+
+    def report(self):
+        """Rejection counts, most frequent first."""
+        return dict(self.counts.most_common())
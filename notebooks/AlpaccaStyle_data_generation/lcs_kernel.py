@@ -0,0 +1,141 @@
+"""
+Bit-parallel LCS over interned token ids (Allison-Dix / Hyyro).
+
+The query is encoded as one match bit-vector per distinct token. Corpus entries are laid out as a padded
+id matrix and advanced one column at a time, so scoring a query against many entries is a handful of NumPy
+word operations per token position instead of a Python O(n*m) table per entry.
+"""
+import numpy as np
+
+PAD_ID = -1
+_WORD_BITS = 64
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+
+
+def fmeasure(lcs, target_len, prediction_len):
+    """Vectorized `rouge_scorer._score_lcs(target, prediction).fmeasure` for known LCS lengths."""
+    lcs = np.asarray(lcs, dtype=np.float64)
+    precision = lcs / np.maximum(prediction_len, 1)
+    recall = lcs / max(target_len, 1)
+    denom = precision + recall
+    return np.where(denom > 0, 2 * precision * recall / np.where(denom > 0, denom, 1), 0.0)
+
+
+def _popcount(words):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    return _BYTE_POPCOUNT[words.view(np.uint8)].reshape(words.shape[0], -1).sum(axis=-1)
+
+
+class TokenVocab(object):
+    """Interns token strings to dense int ids."""
+
+    def __init__(self, tokens=()):
+        self.token_to_id = {t: i for i, t in enumerate(tokens)}
+
+    def __len__(self):
+        return len(self.token_to_id)
+
+    @property
+    def tokens(self):
+        """All interned tokens, in id order."""
+        return list(self.token_to_id)
+
+    def encode(self, tokens):
+        ids = [self.token_to_id.setdefault(t, len(self.token_to_id)) for t in tokens]
+        return np.asarray(ids, dtype=np.int32)
+
+
+class BitParallelLcs(object):
+    """A growable corpus of token id sequences that scores LCS against one query in a single batched call."""
+
+    def __init__(self):
+        self._matrix = np.full((16, 16), PAD_ID, dtype=np.int32)
+        self._lengths = np.zeros(16, dtype=np.int32)
+        self._size = 0
+        self._max_id = -1
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def lengths(self):
+        return self._lengths[: self._size]
+
+    def ids(self, i):
+        """Token ids of entry `i`, as a view into the padded matrix."""
+        return self._matrix[i, : self._lengths[i]]
+
+    def add(self, ids):
+        ids = np.asarray(ids, dtype=np.int32)
+        rows, width = self._matrix.shape
+        if self._size == rows or len(ids) > width:
+            grown = np.full((rows * 2 if self._size == rows else rows, max(width, len(ids))), PAD_ID, dtype=np.int32)
+            grown[:rows, :width] = self._matrix
+            self._matrix = grown
+            self._lengths = np.resize(self._lengths, grown.shape[0])
+        self._matrix[self._size, : len(ids)] = ids
+        self._matrix[self._size, len(ids) :] = PAD_ID
+        self._lengths[self._size] = len(ids)
+        self._size += 1
+        if len(ids):
+            self._max_id = max(self._max_id, int(ids.max()))
+
+    def lcs(self, query_ids, rows=None):
+        """LCS length between `query_ids` and each corpus entry in `rows` (default: all entries)."""
+        query_ids = np.asarray(query_ids, dtype=np.int32)
+        rows = np.arange(self._size) if rows is None else np.asarray(rows, dtype=np.int64)
+        out = np.zeros(len(rows), dtype=np.int64)
+        m = len(query_ids)
+        if m == 0 or len(rows) == 0:
+            return out
+
+        # one match bit-vector per distinct query token; slot 0 is the all-zero mask for every other id
+        num_words = (m + _WORD_BITS - 1) // _WORD_BITS
+        distinct, inverse = np.unique(query_ids, return_inverse=True)
+        masks = np.zeros((len(distinct) + 1, num_words), dtype=np.uint64)
+        positions = np.arange(m)
+        np.bitwise_or.at(
+            masks,
+            (inverse + 1, positions // _WORD_BITS),
+            np.left_shift(np.uint64(1), (positions % _WORD_BITS).astype(np.uint64)),
+        )
+        slot = np.zeros(max(self._max_id, int(distinct.max())) + 2, dtype=np.int32)
+        slot[distinct + 1] = np.arange(1, len(distinct) + 1, dtype=np.int32)
+
+        # longest entries first, so the active rows at column j are always a prefix
+        order = np.argsort(-self._lengths[rows], kind="stable")
+        sorted_rows = rows[order]
+        lengths = self._lengths[sorted_rows]
+        ids = self._matrix[sorted_rows, : int(lengths[0])]
+        active_counts = np.searchsorted(-lengths, -np.arange(ids.shape[1]), side="left")
+
+        v = np.full((len(sorted_rows), num_words), np.uint64(0xFFFFFFFFFFFFFFFF), dtype=np.uint64)
+        for j in range(ids.shape[1]):
+            k = int(active_counts[j])
+            if k == 0:
+                break
+            match = masks[slot[ids[:k, j] + 1]]
+            vk = v[:k]
+            u = vk & match
+            # V' = (V + U) | (V & ~M), with the addition carried across words
+            carry = np.zeros(k, dtype=np.uint64)
+            added = np.empty_like(vk)
+            for w in range(num_words):
+                t = vk[:, w] + u[:, w]
+                c1 = t < vk[:, w]
+                s = t + carry
+                carry = (c1 | (s < t)).astype(np.uint64)
+                added[:, w] = s
+            v[:k] = added | (vk & ~match)
+
+        low = np.full(num_words, np.uint64(0xFFFFFFFFFFFFFFFF), dtype=np.uint64)
+        if m % _WORD_BITS:
+            low[-1] = np.uint64((1 << (m % _WORD_BITS)) - 1)
+        out[order] = m - _popcount(v & low)
+        return out
+
+    def fmeasure(self, query_ids, rows=None):
+        """ROUGE-L fmeasure of `query_ids` (as target) against each entry in `rows`, matching rouge_score."""
+        rows = np.arange(self._size) if rows is None else np.asarray(rows, dtype=np.int64)
+        return fmeasure(self.lcs(query_ids, rows), len(query_ids), self._lengths[rows])
@@ -0,0 +1,201 @@
+"""
+MinHash + LSH near-duplicate detection for self-instruct generation.
+
+An approximate alternative to the exact ROUGE-L gate in `rouge_dedup`, whose cost grows with the corpus. Every
+instruction is reduced to the set of its token shingles (word n-grams) and summarized by a MinHash signature; the
+signatures are split into bands and hashed into buckets, so a query only compares against entries that share a
+bucket with it. The expected cost of a query stays roughly constant as the corpus grows.
+
+Matches are judged by estimated Jaccard similarity of the shingle sets, not by ROUGE-L. The two measures agree on
+clear duplicates but differ near the threshold; `agreement_report` measures how much on a sample.
+"""
+import collections
+
+import numpy as np
+
+from lcs_kernel import TokenVocab
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def optimal_bands(num_perm, threshold):
+    """The (bands, rows) split of `num_perm` whose LSH S-curve crosses 50% closest to `threshold`."""
+    best = None
+    for bands in range(1, num_perm + 1):
+        if num_perm % bands:
+            continue
+        rows = num_perm // bands
+        crossing = (1.0 / bands) ** (1.0 / rows)
+        if best is None or abs(crossing - threshold) < best[0]:
+            best = (abs(crossing - threshold), bands, rows)
+    return best[1], best[2]
+
+
+class MinHashLshIndex(object):
+    """MinHash signatures of the corpus with LSH banding for sublinear near-duplicate queries.
+
+    Args:
+        threshold: Estimated Jaccard similarity at or above which two instructions count as near-duplicates.
+        num_perm: Number of hash permutations (signature length).
+        shingle_size: Tokens per shingle; instructions shorter than this become a single shingle.
+        seed: Seed for the permutations, so signatures are comparable across runs.
+        vocab: `TokenVocab` used to intern tokens. Shared with the caller if given.
+    """
+
+    def __init__(self, threshold=0.4, num_perm=128, shingle_size=2, seed=1, vocab=None):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = optimal_bands(num_perm, threshold)
+        self.vocab = vocab if vocab is not None else TokenVocab()
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._signatures = np.zeros((64, num_perm), dtype=np.uint32)
+        self._size = 0
+        self._buckets = [collections.defaultdict(list) for _ in range(self.bands)]
+
+    def __len__(self):
+        return self._size
+
+    def signature(self, tokens):
+        return self.signature_ids(self.vocab.encode(tokens))
+
+    def signature_ids(self, ids):
+        """MinHash signature of an instruction already interned with `vocab`."""
+        ids = np.asarray(ids, dtype=np.uint64)
+        k = self.shingle_size
+        if len(ids) == 0:
+            shingles = np.zeros(1, dtype=np.uint64)
+        elif len(ids) < k:
+            shingles = np.array([ids.sum() * np.uint64(0x9E3779B1)], dtype=np.uint64)
+        else:
+            # polynomial hash of each window of k token ids (wraps around in uint64, which is fine for hashing)
+            shingles = np.zeros(len(ids) - k + 1, dtype=np.uint64)
+            for j in range(k):
+                shingles = shingles * np.uint64(1000003) + ids[j : len(ids) - k + 1 + j]
+        shingles = np.unique(shingles & _MAX_HASH)
+        hashed = (self._a[:, None] * shingles[None, :] + self._b[:, None]) % _MERSENNE_PRIME
+        return (hashed & _MAX_HASH).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows : (i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, tokens, signature=None):
+        """Index an accepted instruction. Returns its position in the corpus."""
+        return self._add_signature(self.signature(tokens) if signature is None else signature)
+
+    def add_ids(self, ids):
+        return self._add_signature(self.signature_ids(ids))
+
+    def _add_signature(self, signature):
+        if self._size == len(self._signatures):
+            grown = np.zeros((2 * len(self._signatures), self.num_perm), dtype=np.uint32)
+            grown[: self._size] = self._signatures[: self._size]
+            self._signatures = grown
+        self._signatures[self._size] = signature
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            bucket[key].append(self._size)
+        self._size += 1
+        return self._size - 1
+
+    def candidates(self, signature):
+        """Corpus positions that share at least one LSH bucket with `signature`, sorted."""
+        found = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            found.update(bucket.get(key, ()))
+        return np.fromiter(sorted(found), dtype=np.int64, count=len(found))
+
+    def similarities(self, signature, positions):
+        """Estimated Jaccard similarity of `signature` with the entries at `positions`."""
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.float64)
+        return (self._signatures[positions] == signature[None, :]).mean(axis=1)
+
+    def query(self, tokens, k=10):
+        """Approximate `k` most similar corpus entries. Returns (positions, similarities), most similar first.
+
+        Only LSH candidates are considered, so entries well below the threshold are usually missed.
+        """
+        signature = self.signature(tokens)
+        positions = self.candidates(signature)
+        sims = self.similarities(signature, positions)
+        order = np.argsort(-sims, kind="stable")[:k]
+        return positions[order], sims[order]
+
+    def exceeds(self, tokens, threshold=None, signature=None):
+        """Whether any corpus entry is a near-duplicate of `tokens` (estimated Jaccard >= threshold)."""
+        signature = self.signature(tokens) if signature is None else signature
+        sims = self.similarities(signature, self.candidates(signature))
+        return bool(len(sims)) and sims.max() >= (self.threshold if threshold is None else threshold)
+
+    def filter_batch(self, token_batch, k=10):
+        """Gate a batch in order, as if each candidate were checked and, if novel, added before the next.
+
+        Returns:
+            One entry per candidate: None if it is a near-duplicate, otherwise (positions, similarities) of its
+            approximate top-`k` neighbors among the corpus before it. Novel candidates are added to the index.
+        """
+        results = []
+        for tokens in token_batch:
+            signature = self.signature(tokens)
+            positions = self.candidates(signature)
+            sims = self.similarities(signature, positions)
+            if len(sims) and sims.max() >= self.threshold:
+                results.append(None)
+                continue
+            order = np.argsort(-sims, kind="stable")[:k]
+            results.append((positions[order], sims[order]))
+            self.add(tokens, signature)
+        return results
+
+
+def agreement_report(corpus_tokens, rouge_threshold=0.7, jaccard_threshold=0.4, sample_size=200, seed=0, **kwargs):
+    """Compare MinHash-LSH and exact ROUGE-L duplicate decisions on a sample of the corpus.
+
+    Each sampled instruction is checked against every other instruction in the corpus by both methods.
+
+    Returns:
+        A dict with the confusion counts (taking ROUGE-L as ground truth), agreement rate, MinHash precision and
+        recall, and the mean fraction of the ROUGE-L top-10 neighbors that MinHash also returns.
+    """
+    from rouge_dedup import RougeScoringPool
+
+    index = MinHashLshIndex(threshold=jaccard_threshold, **kwargs)
+    for tokens in corpus_tokens:
+        index.add(tokens)
+    rng = np.random.RandomState(seed)
+    sample = rng.choice(len(corpus_tokens), size=min(sample_size, len(corpus_tokens)), replace=False)
+    counts = collections.Counter()
+    overlaps = []
+    with RougeScoringPool(corpus_tokens) as rouge_pool:
+        for i in sample:
+            rouge_scores = rouge_pool.score(corpus_tokens[i])
+            rouge_scores[i] = -1.0
+            signature = index.signature(corpus_tokens[i])
+            positions = index.candidates(signature)
+            positions = positions[positions != i]
+            sims = index.similarities(signature, positions)
+            rouge_dup = bool(rouge_scores.max() > rouge_threshold)
+            minhash_dup = bool(len(sims)) and sims.max() >= jaccard_threshold
+            counts[("tp" if minhash_dup else "fn") if rouge_dup else ("fp" if minhash_dup else "tn")] += 1
+            rouge_top = set(np.argsort(rouge_scores)[-10:].tolist())
+            minhash_top = set(positions[np.argsort(-sims, kind="stable")[:10]].tolist())
+            overlaps.append(len(rouge_top & minhash_top) / 10)
+    tp, fp, fn, tn = counts["tp"], counts["fp"], counts["fn"], counts["tn"]
+    return {
+        "sample_size": len(sample),
+        "rouge_threshold": rouge_threshold,
+        "jaccard_threshold": jaccard_threshold,
+        "bands": index.bands,
+        "rows": index.rows,
+        "true_positive": tp,
+        "false_positive": fp,
+        "false_negative": fn,
+        "true_negative": tn,
+        "agreement": (tp + tn) / max(len(sample), 1),
+        "precision": tp / (tp + fp) if tp + fp else None,
+        "recall": tp / (tp + fn) if tp + fn else None,
+        "top10_recall": float(np.mean(overlaps)) if overlaps else None,
+    }
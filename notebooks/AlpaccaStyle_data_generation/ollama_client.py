@@ -0,0 +1,231 @@
+"""
+Shared HTTP client for every Ollama caller (utils.py and the auto_seed_generation scripts).
+
+All requests go through one `requests.Session` with a pooled, keep-alive connection adapter, so repeated
+calls reuse TCP connections instead of opening a new one per request.
+
+`host` may also be a list of endpoints, or a comma-separated string such as
+OLLAMA_HOST="http://a:11434,http://b:11434". Requests are then dispatched to the healthy endpoint with the fewest
+outstanding requests; an endpoint that keeps failing is ejected for a while and only reinstated once its health
+check passes again. The health check runs in a background thread, one at a time per endpoint, so requests never
+wait for it.
+
+Environment overrides:
+    OLLAMA_POOL_SIZE: maximum pooled connections per host (default 16).
+    OLLAMA_CONNECT_TIMEOUT: seconds to wait for a connection (default 10).
+    OLLAMA_EJECT_AFTER: consecutive failures before an endpoint is ejected (default 3).
+    OLLAMA_EJECT_SECONDS: how long an ejected endpoint is left alone before it is re-checked (default 30).
+"""
+import collections
+import os
+import threading
+import time
+
+# requests is imported where a session is first needed, so importing this module stays cheap
+_lock = threading.Lock()
+_session = None
+_config = {
+    "pool_size": int(os.getenv("OLLAMA_POOL_SIZE", "16")),
+    "connect_timeout": float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "10")),
+    "eject_after": int(os.getenv("OLLAMA_EJECT_AFTER", "3")),
+    "eject_seconds": float(os.getenv("OLLAMA_EJECT_SECONDS", "30")),
+}
+_pools = {}
+
+
+def configure(pool_size=None, connect_timeout=None):
+    """Change the pool size and/or connect timeout. The session is rebuilt on its next use."""
+    global _session
+    with _lock:
+        if pool_size is not None:
+            _config["pool_size"] = int(pool_size)
+        if connect_timeout is not None:
+            _config["connect_timeout"] = float(connect_timeout)
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def ensure_pool_size(pool_size):
+    """Grow the connection pool to at least `pool_size` connections per host."""
+    if pool_size > _config["pool_size"]:
+        configure(pool_size=pool_size)
+
+
+def session():
+    """The process-wide pooled session."""
+    global _session
+    with _lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=_config["pool_size"], pool_maxsize=_config["pool_size"])
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _session = s
+        return _session
+
+
+class _Endpoint(object):
+    def __init__(self, host):
+        self.host = host
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+        self.probing = False
+        self.latencies = collections.deque(maxlen=1000)
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(q):
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "outstanding": self.outstanding,
+            "ejections": self.ejections,
+            "ejected": self.ejected_until > 0,
+            "latency_mean": sum(latencies) / len(latencies) if latencies else None,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+        }
+
+
+class EndpointPool(object):
+    """Least-outstanding-requests dispatch over several Ollama hosts, with ejection of failing hosts."""
+
+    def __init__(self, hosts, eject_after=None, eject_seconds=None):
+        self.endpoints = [_Endpoint(h.rstrip("/")) for h in hosts]
+        self.eject_after = eject_after or _config["eject_after"]
+        self.eject_seconds = eject_seconds or _config["eject_seconds"]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, exclude=()):
+        """Pick an endpoint and count a request against it. Ejected endpoints are only used as a last resort."""
+        now = time.time()
+        candidates = [e for e in self.endpoints if e.host not in exclude] or self.endpoints
+        with self._lock:
+            for e in candidates:
+                # an ejection has expired: the endpoint must pass a health check before it gets traffic again
+                if 0 < e.ejected_until <= now and not e.probing:
+                    e.probing = True
+                    threading.Thread(target=self._probe, args=(e,), daemon=True).start()
+            healthy = [e for e in candidates if not e.ejected_until]
+            if healthy:
+                # ties go to the endpoint that has served the fewest requests, so idle hosts take turns
+                endpoint = min(healthy, key=lambda e: (e.outstanding, e.requests))
+            else:
+                endpoint = min(candidates, key=lambda e: e.ejected_until)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        return endpoint
+
+    def release(self, endpoint, latency, ok):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.consecutive_failures = 0
+                endpoint.latencies.append(latency)
+                return
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.eject_after and endpoint.ejected_until <= time.time():
+                endpoint.ejected_until = time.time() + self.eject_seconds
+                endpoint.ejections += 1
+
+    def _probe(self, endpoint):
+        healthy = self.is_healthy(endpoint.host)
+        with self._lock:
+            if healthy:
+                endpoint.ejected_until = 0.0
+                endpoint.consecutive_failures = 0
+            else:
+                endpoint.ejected_until = time.time() + self.eject_seconds
+            endpoint.probing = False
+
+    def is_healthy(self, host):
+        import requests
+
+        try:
+            r = session().get(f"{host}/api/tags", timeout=(_config["connect_timeout"], 5))
+            return r.status_code < 500
+        except requests.RequestException:
+            return False
+
+    def stats(self):
+        return {e.host: e.stats() for e in self.endpoints}
+
+
+def parse_hosts(host):
+    hosts = host if isinstance(host, (list, tuple)) else str(host).split(",")
+    return [h.strip().rstrip("/") for h in hosts if h.strip()]
+
+
+def endpoint_pool(host):
+    """The process-wide `EndpointPool` for `host` (a URL, a list of URLs or a comma-separated string)."""
+    key = tuple(parse_hosts(host))
+    with _lock:
+        if key not in _pools:
+            _pools[key] = EndpointPool(key)
+        return _pools[key]
+
+
+def endpoint_stats():
+    """Per-endpoint request counts, failures and latency for every host used in this process."""
+    return {host: s for pool in list(_pools.values()) for host, s in pool.stats().items()}
+
+
+def post(host, path, payload, timeout=600, **kwargs):
+    """POST `payload` as JSON to `path` on `host` (or on the least loaded of several hosts).
+
+    `timeout` is the read timeout in seconds. Connection errors are retried once on every other endpoint.
+    With `stream=True` the endpoint counts as busy until the returned response is closed.
+    """
+    import requests
+
+    pool = endpoint_pool(host)
+    tried = []
+    while True:
+        endpoint = pool.acquire(exclude=tried)
+        start = time.time()
+        try:
+            r = session().post(
+                f"{endpoint.host}/{path.lstrip('/')}",
+                json=payload,
+                timeout=(_config["connect_timeout"], timeout),
+                **kwargs,
+            )
+        except requests.ConnectionError:
+            pool.release(endpoint, time.time() - start, ok=False)
+            tried.append(endpoint.host)
+            if len(tried) >= len(pool):
+                raise
+            continue
+        except requests.RequestException:
+            pool.release(endpoint, time.time() - start, ok=False)
+            raise
+        break
+    ok = r.status_code < 500
+    if not kwargs.get("stream"):
+        pool.release(endpoint, time.time() - start, ok)
+        return r
+    close = r.close
+
+    def release_on_close():
+        if not getattr(r, "_endpoint_released", False):
+            r._endpoint_released = True
+            pool.release(endpoint, time.time() - start, ok)
+        close()
+
+    r.close = release_on_close
+    return r
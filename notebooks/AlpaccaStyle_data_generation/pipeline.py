@@ -0,0 +1,105 @@
+"""
+Producer/consumer pipeline that overlaps LLM requests with post-processing and dedup.
+
+Producer threads each run `make_request` in a loop and hand its items to the consumer through a bounded
+queue, so up to `depth` requests are in flight while the consumer parses, filters and dedups earlier ones.
+`make_request` returns an iterable, which lets a streaming request hand over partial results before it
+finishes. Closing the pipeline stops the producers from starting new requests and sets the `stop` event, which
+requests in flight watch to abort early; it then waits (bounded) for the producers to exit.
+"""
+import queue
+import threading
+import time
+
+
+class RequestPipeline(object):
+    """Keeps `depth` requests in flight and yields their items in completion order.
+
+    Args:
+        make_request: Zero-argument callable that issues one request and returns an iterable of items
+            (e.g. a generator). Generators that are abandoned on close are closed, which cancels streams.
+        depth: Number of producer threads, i.e. requests in flight at once. With 0 the requests run inline in
+            the consuming thread, one at a time.
+        queue_size: Maximum number of finished items waiting for the consumer (default: `depth`).
+        stop: Optional `threading.Event` that is set on close, so `make_request` can cancel its request.
+    """
+
+    def __init__(self, make_request, depth, queue_size=None, stop=None):
+        self.make_request = make_request
+        self._queue = queue.Queue(maxsize=queue_size or max(depth, 1))
+        self._stop = stop if stop is not None else threading.Event()
+        self._inline = None
+        self._threads = [threading.Thread(target=self._produce, daemon=True) for _ in range(depth)]
+        for thread in self._threads:
+            thread.start()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        while not self._stop.is_set():
+            items = None
+            try:
+                items = iter(self.make_request())
+                for item in items:
+                    if not self._put((item, None)):
+                        break
+            except Exception as e:
+                self._put((None, e))
+            finally:
+                if hasattr(items, "close"):
+                    items.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._threads:
+            while True:
+                if self._inline is None:
+                    self._inline = iter(self.make_request())
+                try:
+                    return next(self._inline)
+                except StopIteration:
+                    self._inline = None
+        item, error = self._queue.get()
+        if error is not None:
+            self.close()
+            raise error
+        return item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self, timeout=10.0):
+        """Stop starting new requests, cancel the ones in flight and wait up to `timeout` seconds for the producers.
+
+        Items of requests still in flight are discarded. Returns the number of producers still running after the
+        timeout (0 on a clean stop), so the caller knows whether it is safe to tear down what they use.
+        """
+        self._stop.set()
+        if hasattr(self._inline, "close"):
+            self._inline.close()
+        deadline = time.time() + timeout
+        for thread in self._threads:
+            # keep draining, so producers blocked on a full queue can see the stop flag
+            while thread.is_alive() and time.time() < deadline:
+                try:
+                    self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        return sum(thread.is_alive() for thread in self._threads)
@@ -0,0 +1,146 @@
+"""
+Append-only JSONL checkpoint for machine-generated instructions.
+
+Every request round appends its accepted instructions as one JSON object per line, so checkpointing costs
+the size of the round rather than the size of the whole run. Writes are flushed every round and fsynced in
+batches; a torn last line left by a crash is truncated away the next time the log is opened.
+"""
+import json
+import os
+import time
+
+import utils
+
+
+def _line_start(f, pos, chunk_size=65536):
+    """Offset just past the last newline before `pos` (0 if there is none)."""
+    while pos > 0:
+        start = max(0, pos - chunk_size)
+        f.seek(start)
+        found = f.read(pos - start).rfind(b"\n")
+        if found >= 0:
+            return start + found + 1
+        pos = start
+    return 0
+
+
+def recover(path):
+    """Truncate a partially written tail from the log at `path`. Returns the number of bytes dropped."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as f:
+        size = end = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                end = _line_start(f, size)
+        # the last terminated line can still be torn if the crash hit mid-write
+        if end:
+            start = _line_start(f, end - 1)
+            f.seek(start)
+            try:
+                json.loads(f.read(end - start))
+            except ValueError:
+                end = start
+        if end != size:
+            f.truncate(end)
+            f.flush()
+            os.fsync(f.fileno())
+    return size - end
+
+
+def load(path):
+    """Load all entries from the log at `path`, recovering a torn tail first."""
+    if not os.path.exists(path):
+        return []
+    recover(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_or_migrate(log_path, json_path):
+    """Load the log at `log_path`, first migrating the legacy `regen.json` at `json_path` into it if there is no log.
+
+    The migrated log is written to a temporary file and moved into place, so a crash during the migration never
+    leaves a partial log that would shadow `regen.json` on the next run.
+    """
+    if not os.path.exists(log_path) and os.path.exists(json_path):
+        tmp_path = log_path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        with RegenLog(tmp_path) as log:
+            log.append(utils.jload(json_path))
+        os.replace(tmp_path, log_path)
+    return load(log_path)
+
+
+def resolve_neighbors(entries, seed_instructions):
+    """Spell out neighbors logged as `[[position, score], ...]` into `{instruction: score}` dicts, in place.
+
+    Positions index the corpus the run deduplicated against: `seed_instructions` followed by the logged entries.
+    Entries written before neighbors were logged by position already hold the dict and are left alone.
+    """
+    corpus = list(seed_instructions) + [e["instruction"] for e in entries]
+    for entry in entries:
+        neighbors = entry.get("most_similar_instructions")
+        if isinstance(neighbors, list):
+            entry["most_similar_instructions"] = {corpus[i]: score for i, score in neighbors}
+    return entries
+
+
+def compact(log_path, json_path, seed_instructions=()):
+    """Write the legacy `regen.json` (a single indented JSON list) from the log, with neighbors resolved to text."""
+    entries = resolve_neighbors(load(log_path), seed_instructions)
+    tmp_path = json_path + ".tmp"
+    utils.jdump(entries, tmp_path)
+    os.replace(tmp_path, json_path)
+    return len(entries)
+
+
+class RegenLog(object):
+    """Crash-safe append-only writer for accepted instructions.
+
+    Args:
+        path: Location of the JSONL log.
+        fsync_every: Force the log to disk after this many appended entries...
+        fsync_interval: ...or after this many seconds since the last fsync, whichever comes first.
+    """
+
+    def __init__(self, path, fsync_every=256, fsync_interval=10.0):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        recover(path)
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._f = open(path, "a", encoding="utf-8")
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, entries):
+        if not entries:
+            return
+        self._f.write("".join(json.dumps(e, default=str) + "\n" for e in entries))
+        self._f.flush()
+        self._unsynced += len(entries)
+        if self._unsynced >= self.fsync_every or time.time() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def close(self):
+        if self._f.closed:
+            return
+        self.sync()
+        self._f.close()
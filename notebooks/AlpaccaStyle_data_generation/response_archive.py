@@ -0,0 +1,58 @@
+"""
+Compressed, append-only archive of raw LLM responses.
+
+Each append writes one gzip member holding JSON lines, and concatenated members read back as a single gzip
+stream, so the archive never has to be rewritten. Reading stops at a tail torn by a crash, keeping every
+complete line before it. Keeping the raw text lets the parsing, filtering and dedup stages be replayed with new
+settings without generating again.
+"""
+import gzip
+import json
+import os
+import threading
+import zlib
+
+
+class ResponseArchive(object):
+    """Appends batches of records (JSON-serializable dicts) to a gzip file. Safe to share between threads."""
+
+    def __init__(self, path, compresslevel=6):
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.path = path
+        self.compresslevel = compresslevel
+        self._lock = threading.Lock()
+        self._f = open(path, "ab")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, records):
+        if not records:
+            return
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records).encode("utf-8")
+        member = gzip.compress(data, compresslevel=self.compresslevel)
+        with self._lock:
+            self._f.write(member)
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._f.closed:
+                self._f.close()
+
+
+def iter_records(path):
+    """Yield the archived records in the order they were appended, stopping at a torn tail."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error):
+            return
@@ -0,0 +1,392 @@
+"""
+ROUGE-L novelty scoring for self-instruct generation.
+
+The corpus of tokenized instructions is sharded across long-lived worker processes. Each worker keeps its
+shard for the whole run, so a query only ships the new instruction's tokens and accepted instructions are
+appended to a single shard instead of re-pickling the corpus for every candidate.
+
+Each shard also keeps a token postings index. The number of tokens a candidate shares with a corpus entry
+bounds their LCS, so the exact LCS only runs on entries whose bounded fmeasure could cross the threshold.
+
+Tokens are interned to int ids in the parent process; the exact scores come from the batched bit-parallel
+kernel in `lcs_kernel`, which matches `rouge_scorer._score_lcs` exactly.
+"""
+import array
+import collections
+import multiprocessing
+
+import numpy as np
+
+from lcs_kernel import BitParallelLcs, TokenVocab, fmeasure
+
+
+class TokenPostingsIndex(object):
+    """Inverted index from token to the corpus entries containing it, with per-entry token counts."""
+
+    def __init__(self):
+        self._docs = collections.defaultdict(lambda: array.array("i"))
+        self._counts = collections.defaultdict(lambda: array.array("i"))
+        self._lengths = array.array("i")
+
+    def __len__(self):
+        return len(self._lengths)
+
+    @property
+    def lengths(self):
+        return np.frombuffer(self._lengths, dtype=np.int32) if len(self._lengths) else np.zeros(0, dtype=np.int32)
+
+    def add(self, tokens):
+        doc = len(self._lengths)
+        for token, count in collections.Counter(tokens).items():
+            self._docs[token].append(doc)
+            self._counts[token].append(count)
+        self._lengths.append(len(tokens))
+
+    def overlap(self, tokens):
+        """Size of the multiset intersection between `tokens` and every corpus entry."""
+        overlap = np.zeros(len(self._lengths), dtype=np.int32)
+        for token, count in collections.Counter(tokens).items():
+            if token not in self._docs:
+                continue
+            docs = np.frombuffer(self._docs[token], dtype=np.int32)
+            counts = np.frombuffer(self._counts[token], dtype=np.int32)
+            overlap[docs] += np.minimum(counts, count)
+        return overlap
+
+    def candidates(self, tokens, threshold=None):
+        """Indices of entries sharing a token with `tokens` whose fmeasure bound exceeds `threshold` (if given).
+
+        The LCS of two token sequences never exceeds their multiset overlap, so entries outside this set are
+        guaranteed to score at most `threshold` (and exactly 0 when they share no token).
+        """
+        overlap = self.overlap(tokens)
+        if threshold is None:
+            return np.flatnonzero(overlap)
+        bound = fmeasure(overlap, len(tokens), self.lengths)
+        return np.flatnonzero(bound > threshold)
+
+
+class _Shard(object):
+    """A slice of the interned corpus, owned by one worker."""
+
+    def __init__(self, corpus_ids=()):
+        self.index = TokenPostingsIndex()
+        self.kernel = BitParallelLcs()
+        for ids in corpus_ids:
+            self.add(ids)
+
+    def add(self, ids):
+        self.index.add(ids.tolist())
+        self.kernel.add(ids)
+
+    def ids(self):
+        return [self.kernel.ids(i) for i in range(len(self.kernel))]
+
+    def scores(self, ids):
+        scores = np.zeros(len(self.kernel), dtype=np.float64)
+        rows = self.index.candidates(ids.tolist())
+        scores[rows] = self.kernel.fmeasure(ids, rows)
+        return scores
+
+    def exceeds(self, ids, threshold):
+        rows = self.index.candidates(ids.tolist(), threshold)
+        return bool(len(rows)) and bool((self.kernel.fmeasure(ids, rows) > threshold).any())
+
+    def scores_many(self, batch):
+        return [self.scores(ids) for ids in batch]
+
+    def summary(self, ids, k, sample_size, seed, num_strata=4):
+        """Top-`k` entries and an estimate of the total fmeasure of `ids` against the shard, without a full scan.
+
+        Entries sharing no token with `ids` score exactly 0. Among the rest, the exact fmeasure is computed for
+        the entries with the highest overlap bound until no remaining bound can beat the current k-th score,
+        so the top-k is exact up to ties. The total over the remaining candidates is estimated from a
+        stratified sample (strata by overlap bound, allocated proportionally).
+
+        Returns:
+            (rows, scores, total, variance): the top-k shard rows and their fmeasure (unordered), the estimated
+            sum of fmeasure over the shard, and the variance of that estimate.
+        """
+        overlap = self.index.overlap(ids.tolist())
+        rows = np.flatnonzero(overlap)
+        empty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        if not len(rows) or not len(ids):
+            return empty[0], empty[1], 0.0, 0.0
+        bound = fmeasure(overlap[rows], len(ids), self.index.lengths[rows])
+        scores = np.full(len(rows), np.nan)
+        pending = np.arange(len(rows))
+        chunk = max(4 * k, 64)
+        while len(pending):
+            if len(pending) > chunk:
+                picked = np.argpartition(-bound[pending], chunk)[:chunk]
+            else:
+                picked = np.arange(len(pending))
+            batch = pending[picked]
+            scores[batch] = self.kernel.fmeasure(ids, rows[batch])
+            pending = np.delete(pending, picked)
+            done = np.flatnonzero(~np.isnan(scores))
+            if len(done) >= k and len(pending):
+                kth = scores[done[np.argpartition(-scores[done], k - 1)[k - 1]]]
+                if bound[pending].max() <= kth:
+                    break
+        done = np.flatnonzero(~np.isnan(scores))
+        top = done[np.argpartition(-scores[done], k - 1)[:k]] if len(done) > k else done
+        total, variance = float(scores[done].sum()), 0.0
+        if len(pending) <= sample_size:
+            total += float(self.kernel.fmeasure(ids, rows[pending]).sum()) if len(pending) else 0.0
+            return rows[top], scores[top], total, variance
+        rng = np.random.default_rng([seed, len(self.kernel)])
+        edges = np.quantile(bound[pending], np.linspace(0, 1, num_strata + 1)[1:-1])
+        strata = np.digitize(bound[pending], edges)
+        for h in range(num_strata):
+            members = pending[strata == h]
+            size = len(members)
+            if not size:
+                continue
+            n = min(size, max(2, int(round(sample_size * size / len(pending)))))
+            sample = self.kernel.fmeasure(ids, rows[rng.choice(members, size=n, replace=False)])
+            total += size * float(sample.mean())
+            if n < size and n > 1:
+                variance += size * size * (1 - n / size) * float(sample.var(ddof=1)) / n
+        return rows[top], scores[top], total, variance
+
+    def exceeds_many(self, batch, threshold):
+        return [self.exceeds(ids, threshold) for ids in batch]
+
+
+def _worker_loop(conn, corpus_ids):
+    shard = _Shard(corpus_ids)
+    while True:
+        cmd, payload = conn.recv()
+        if cmd == "score":
+            conn.send(shard.scores(payload))
+        elif cmd == "exceeds":
+            conn.send(shard.exceeds(*payload))
+        elif cmd == "scores_many":
+            conn.send(shard.scores_many(payload))
+        elif cmd == "exceeds_many":
+            conn.send(shard.exceeds_many(*payload))
+        elif cmd == "summary":
+            conn.send(shard.summary(*payload))
+        elif cmd == "add":
+            shard.add(payload)
+        elif cmd == "ids":
+            conn.send(shard.ids())
+        elif cmd == "close":
+            conn.close()
+            return
+
+
+class RougeScoringPool(object):
+    """Scores new instructions against the corpus with a pool created once per run.
+
+    Args:
+        corpus_tokens: Tokenized instructions already in the corpus.
+        num_workers: Number of worker processes. With `num_workers <= 1` scoring happens in-process.
+        corpus_ids: Alternatively, the corpus already interned with `vocab` (e.g. from `token_cache`).
+        vocab: The `TokenVocab` used to intern tokens. Shared with the caller if given.
+    """
+
+    def __init__(self, corpus_tokens=(), num_workers=1, corpus_ids=None, vocab=None):
+        self.vocab = vocab if vocab is not None else TokenVocab()
+        if corpus_ids is None:
+            corpus_ids = [self.vocab.encode(tokens) for tokens in corpus_tokens]
+        self.num_workers = max(1, int(num_workers))
+        # global corpus index of every shard entry, in shard order
+        self._shard_indices = [list(range(w, len(corpus_ids), self.num_workers)) for w in range(self.num_workers)]
+        self._size = len(corpus_ids)
+        self._conns, self._procs = [], []
+        self._local = None
+        if self.num_workers == 1:
+            self._local = _Shard(corpus_ids)
+            return
+        ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+        for indices in self._shard_indices:
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker_loop, args=(child_conn, [corpus_ids[i] for i in indices]), daemon=True)
+            proc.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._procs.append(proc)
+
+    def __len__(self):
+        return self._size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def score(self, tokens):
+        """Return the ROUGE-L fmeasure of `tokens` against every corpus entry, in corpus order."""
+        ids = self.vocab.encode(tokens)
+        if self._local is not None:
+            return self._local.scores(ids)
+        for conn in self._conns:
+            conn.send(("score", ids))
+        scores = np.zeros(self._size, dtype=np.float64)
+        for conn, indices in zip(self._conns, self._shard_indices):
+            shard_scores = conn.recv()
+            if indices:
+                scores[indices] = shard_scores
+        return scores
+
+    def exceeds(self, tokens, threshold):
+        """Whether any corpus entry has a ROUGE-L fmeasure above `threshold` with `tokens`."""
+        ids = self.vocab.encode(tokens)
+        if self._local is not None:
+            return self._local.exceeds(ids, threshold)
+        for conn in self._conns:
+            conn.send(("exceeds", (ids, threshold)))
+        return any([conn.recv() for conn in self._conns])
+
+    def summarize(self, tokens, k=10, sample_size=256, seed=0):
+        """Approximate `score`: the top-`k` neighbors and the mean fmeasure of `tokens` over the corpus.
+
+        See `_Shard.summary`. The top-k comes from `np.argpartition` over the pruned candidates instead of a sort
+        over every score, and the mean is estimated from a stratified sample of the candidates.
+
+        Returns:
+            (positions, scores, mean, error): the top-k corpus positions and fmeasures, most similar first, the
+            estimated mean, and the half-width of its 95% confidence interval. Fewer than `k` neighbors are
+            returned when fewer entries share a token with `tokens`.
+        """
+        return self._summarize(self.vocab.encode(tokens), k, sample_size, seed)
+
+    def _summarize(self, ids, k, sample_size, seed, extra_scores=()):
+        payload = (ids, k, sample_size, seed)
+        if self._local is not None:
+            parts = [self._local.summary(*payload)]
+            indices = [np.arange(self._size)]
+        else:
+            for conn in self._conns:
+                conn.send(("summary", payload))
+            parts = [conn.recv() for conn in self._conns]
+            indices = [np.asarray(shard, dtype=np.int64) for shard in self._shard_indices]
+        positions = np.concatenate([index[rows] for index, (rows, _, _, _) in zip(indices, parts)])
+        scores = np.concatenate([part[1] for part in parts])
+        total = sum(part[2] for part in parts)
+        variance = sum(part[3] for part in parts)
+        # exact scores against entries that follow the corpus but are not added yet (earlier candidates of a batch)
+        extra_scores = np.asarray(extra_scores, dtype=np.float64)
+        positions = np.concatenate([positions, self._size + np.arange(len(extra_scores))])
+        scores = np.concatenate([scores, extra_scores])
+        total += float(extra_scores.sum())
+        if len(scores) > k:
+            keep = np.argpartition(-scores, k - 1)[:k]
+            positions, scores = positions[keep], scores[keep]
+        order = np.lexsort((-positions, -scores))
+        size = max(self._size + len(extra_scores), 1)
+        return positions[order], scores[order], total / size, 1.96 * float(np.sqrt(variance)) / size
+
+    def score_batch(self, token_batch, threshold):
+        """Resolve a batch of candidates against the corpus and each other, as if scored and added one by one.
+
+        Every candidate is gated against the corpus in one round trip, the candidates are scored against each
+        other as a small KxK matrix, and acceptance is then resolved greedily in the original order. Accepted
+        candidates are added to the pool.
+
+        Returns:
+            One entry per candidate: None if it was rejected, otherwise its fmeasure against the corpus followed
+            by the candidates accepted before it, i.e. what `score` would have returned in the sequential loop.
+        """
+        batch = [self.vocab.encode(tokens) for tokens in token_batch]
+        if not batch:
+            return []
+        accepted, pairwise = self._gate(batch, threshold)
+        corpus_scores = self._score_many([batch[i] for i in accepted])
+        results = [None] * len(batch)
+        for n, i in enumerate(accepted):
+            results[i] = np.concatenate([corpus_scores[n], pairwise[i, accepted[:n]]])
+        for i in accepted:
+            self._add_ids(batch[i])
+        return results
+
+    def summarize_batch(self, token_batch, threshold, k=10, sample_size=256, seed=0):
+        """`score_batch` with `summarize` in place of the full score vector of every accepted candidate.
+
+        Returns:
+            One entry per candidate: None if it was rejected, otherwise (positions, scores, mean, error) against
+            the corpus and the candidates accepted before it.
+        """
+        batch = [self.vocab.encode(tokens) for tokens in token_batch]
+        if not batch:
+            return []
+        accepted, pairwise = self._gate(batch, threshold)
+        results = [None] * len(batch)
+        for n, i in enumerate(accepted):
+            results[i] = self._summarize(batch[i], k, sample_size, seed, extra_scores=pairwise[i, accepted[:n]])
+        for i in accepted:
+            self._add_ids(batch[i])
+        return results
+
+    def _gate(self, batch, threshold):
+        """Indices of the candidates in `batch` accepted in order, and their pairwise fmeasure matrix."""
+        if self._local is not None:
+            corpus_hits = self._local.exceeds_many(batch, threshold)
+        else:
+            for conn in self._conns:
+                conn.send(("exceeds_many", (batch, threshold)))
+            corpus_hits = np.any([conn.recv() for conn in self._conns], axis=0)
+
+        # pairwise[i, j]: candidate i as target, candidate j as prediction
+        kernel = BitParallelLcs()
+        for ids in batch:
+            kernel.add(ids)
+        pairwise = np.stack([kernel.fmeasure(ids) for ids in batch])
+        accepted = []
+        for i in range(len(batch)):
+            if corpus_hits[i] or (accepted and (pairwise[i, accepted] > threshold).any()):
+                continue
+            accepted.append(i)
+        return accepted, pairwise
+
+    def _score_many(self, batch):
+        if self._local is not None:
+            return self._local.scores_many(batch)
+        for conn in self._conns:
+            conn.send(("scores_many", batch))
+        scores = np.zeros((len(batch), self._size), dtype=np.float64)
+        for conn, indices in zip(self._conns, self._shard_indices):
+            shard_scores = conn.recv()
+            if indices:
+                for n, row in enumerate(shard_scores):
+                    scores[n, indices] = row
+        return scores
+
+    def corpus_ids(self):
+        """Token ids of every corpus entry, in corpus order, gathered from the shards."""
+        if self._local is not None:
+            return self._local.ids()
+        for conn in self._conns:
+            conn.send(("ids", None))
+        corpus_ids = [None] * self._size
+        for conn, indices in zip(self._conns, self._shard_indices):
+            for i, ids in zip(indices, conn.recv()):
+                corpus_ids[i] = ids
+        return corpus_ids
+
+    def add(self, tokens):
+        """Append an accepted instruction to the smallest shard."""
+        self._add_ids(self.vocab.encode(tokens))
+
+    def _add_ids(self, ids):
+        worker = min(range(self.num_workers), key=lambda w: len(self._shard_indices[w]))
+        self._shard_indices[worker].append(self._size)
+        self._size += 1
+        if self._local is not None:
+            self._local.add(ids)
+        else:
+            self._conns[worker].send(("add", ids))
+
+    def close(self):
+        for conn in self._conns:
+            try:
+                conn.send(("close", None))
+                conn.close()
+            except (BrokenPipeError, OSError):
+                pass
+        for proc in self._procs:
+            proc.join(timeout=5)
+        self._conns, self._procs = [], []
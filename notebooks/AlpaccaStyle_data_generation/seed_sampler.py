@@ -0,0 +1,74 @@
+"""
+Keep-rate-aware sampling of the seed tasks that go into each generation prompt.
+
+Uniform sampling treats every seed alike, but some seeds keep producing instructions that the quality filter or
+the novelty gate throws away. `BanditSeedSampler` runs Thompson sampling over the seeds. Each seed has a Beta
+posterior over the chance that an instruction generated from a prompt containing it is kept. Every generated
+instruction counts as one trial for each seed in its prompt. A prompt takes the seeds with the highest posterior
+draws, except that each slot is filled uniformly at random with probability `exploration`, so no seed is ever
+starved.
+
+With `seed` set, the sampler draws from its own RNG, so the prompts depend only on that seed and the outcomes
+it was shown.
+"""
+import random
+import threading
+
+
+class BanditSeedSampler(object):
+    """Thompson sampling over seed tasks, rewarded by kept instructions.
+
+    Args:
+        num_seeds: Number of seed tasks to choose from.
+        exploration: Probability that a prompt slot is filled uniformly at random instead of by the bandit.
+        prior: (alpha, beta) of the Beta prior on every seed's keep rate.
+        seed: Seed for the sampler's own RNG. None uses the global `random` module, like uniform sampling.
+    """
+
+    def __init__(self, num_seeds, exploration=0.1, prior=(1.0, 1.0), seed=None):
+        self.num_seeds = num_seeds
+        self.exploration = exploration
+        self.prior = prior
+        self.rng = random.Random(seed) if seed is not None else random
+        self.kept = [0] * num_seeds
+        self.trials = [0] * num_seeds
+        self._lock = threading.Lock()
+
+    def sample(self, k):
+        """Indices of `k` distinct seeds for one prompt."""
+        alpha, beta = self.prior
+        with self._lock:
+            draws = [
+                self.rng.betavariate(alpha + kept, beta + trials - kept)
+                for kept, trials in zip(self.kept, self.trials)
+            ]
+            ranked = sorted(range(self.num_seeds), key=draws.__getitem__, reverse=True)
+            chosen = []
+            for _ in range(k):
+                if self.rng.random() < self.exploration:
+                    chosen.append(self.rng.choice([i for i in range(self.num_seeds) if i not in chosen]))
+                else:
+                    chosen.append(next(i for i in ranked if i not in chosen))
+            return chosen
+
+    def observe(self, seeds, kept):
+        """Record one instruction generated from a prompt with `seeds`, and whether it was kept."""
+        with self._lock:
+            for i in seeds:
+                self.trials[i] += 1
+                self.kept[i] += int(kept)
+
+    def keep_rates(self):
+        """Posterior mean keep rate of every seed."""
+        alpha, beta = self.prior
+        return [(alpha + kept) / (alpha + beta + trials) for kept, trials in zip(self.kept, self.trials)]
+
+    def report(self, top=5):
+        rates = self.keep_rates()
+        ranked = sorted(range(self.num_seeds), key=rates.__getitem__, reverse=True)
+        return {
+            "trials": sum(self.trials),
+            "kept": sum(self.kept),
+            "best": [(i, round(rates[i], 3), self.trials[i]) for i in ranked[:top]],
+            "worst": [(i, round(rates[i], 3), self.trials[i]) for i in ranked[-top:]],
+        }
@@ -0,0 +1,286 @@
+"""
+Sharded self-instruct generation: several generator processes, one dedup coordinator.
+
+Each generator worker has its own LLM endpoint and its own RNG stream. It samples prompts from the seed tasks,
+requests completions, and parses, filters and tokenizes the instructions. Each request round goes into the
+worker's own bounded queue, tagged with its sequence number. The coordinator (the parent process) owns the novelty
+index, the corpus and the regen log. It takes rounds in a fixed (sequence, worker) order: round 0 of worker 0,
+round 0 of worker 1, ..., round 1 of worker 0, and so on. Rounds are resolved exactly as in the single-process
+loop. A worker's prompts depend only on its seed, so given the same responses the accepted instructions, and
+their order, do not depend on the timing of the workers.
+
+The coordinator also archives the raw responses of every round it takes, in the same order, so
+`generate_instruction.replay_raw_responses` works on sharded runs too.
+
+run:
+python sharded_generation.py \
+  --output_dir ./ \
+  --num_instructions_to_generate 1000 \
+  --hosts http://gpu0:11434,http://gpu1:11434 \
+  --workers_per_host 2
+"""
+import multiprocessing
+import os
+import queue
+import random
+import time
+import traceback
+
+# rouge_score, tqdm and the numpy-based modules are imported by the functions that use them, as in
+# generate_instruction
+import ollama_client
+import regen_log
+import response_archive
+import utils
+from generate_instruction import (
+    compact_regen_log,
+    encode_prompt,
+    load_seed_instruction_data,
+    parse_instruction_block,
+    split_instruction_blocks,
+    summarize_similarities,
+)
+from instruction_filter import InstructionFilter
+
+import fire
+
+
+def _generator_worker(worker_id, host, rng_seed, seed_instruction_data, config, rounds, stop):
+    """Generate candidate rounds until `stop` is set.
+
+    Each round is put as (sequence, candidates, filter counts, raw response records), or as
+    (None, traceback, None, None) if the worker fails.
+    """
+    try:
+        from rouge_score import rouge_scorer
+
+        # every worker talks to its own endpoint
+        os.environ["OLLAMA_HOST"] = host
+        rng = random.Random(rng_seed)
+        quality_filter = (
+            InstructionFilter.from_file(config["blacklist_path"]) if config["blacklist_path"] else InstructionFilter()
+        )
+        tokenizer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)._tokenizer
+        num_prompt_instructions = config["num_prompt_instructions"]
+        decoding_args = utils.OpenAIDecodingArguments(
+            temperature=config["temperature"],
+            n=1,
+            max_tokens=3072,
+            top_p=config["top_p"],
+            stop=["\n20", "20.", "20."],
+        )
+        sequence = 0
+        while not stop.is_set():
+            batch_inputs = [
+                encode_prompt(rng.sample(seed_instruction_data, num_prompt_instructions))
+                for _ in range(config["request_batch_size"])
+            ]
+            results = utils.openai_completion(
+                prompts=batch_inputs,
+                model_name=config["model_name"],
+                batch_size=config["request_batch_size"],
+                decoding_args=decoding_args,
+                logit_bias={"50256": -100},
+                max_in_flight=config["max_in_flight"],
+                cancel=stop,
+            )
+            records = [
+                {"num_prompt_instructions": num_prompt_instructions, "response": r} for r in results if r is not None
+            ]
+            candidates = []
+            for result in results:
+                for idx, inst in split_instruction_blocks(num_prompt_instructions, result):
+                    instruction_data = parse_instruction_block(idx, inst, quality_filter)
+                    if instruction_data is not None:
+                        candidates.append((instruction_data, tokenizer.tokenize(instruction_data["instruction"])))
+            counts, quality_filter.counts = quality_filter.counts, type(quality_filter.counts)()
+            while not stop.is_set():
+                try:
+                    rounds.put((sequence, candidates, counts, records), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            sequence += 1
+    except utils.RequestCancelled:
+        pass
+    except Exception:
+        rounds.put((None, traceback.format_exc(), None, None))
+
+
+def _next_round(rounds, worker, worker_id, poll_interval=1.0):
+    """The next round of `worker`. Raises if the worker failed, or exited without putting anything."""
+    while True:
+        try:
+            round_sequence, candidates, counts, records = rounds.get(timeout=poll_interval)
+            break
+        except queue.Empty:
+            if not worker.is_alive():
+                raise RuntimeError(f"Generator worker {worker_id} exited with code {worker.exitcode}")
+    if round_sequence is None:
+        raise RuntimeError(f"Generator worker {worker_id} failed:\n{candidates}")
+    return round_sequence, candidates, counts, records
+
+
+def _stop_workers(queues, workers, timeout):
+    """Stop the workers, giving them `timeout` seconds in total to finish their current request."""
+    deadline = time.time() + timeout
+    for rounds, worker in zip(queues, workers):
+        # drain the queue so a worker blocked on a full queue can see the stop flag
+        while worker.is_alive() and time.time() < deadline:
+            try:
+                rounds.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if worker.is_alive():
+            worker.terminate()
+        worker.join(timeout=1.0)
+
+
+def generate_sharded(
+    output_dir="./",
+    seed_tasks_path="auto_seed_generation/seed_tasks_for_gen.jsonl",
+    num_instructions_to_generate=100,
+    model_name="text-davinci-003",
+    num_prompt_instructions=3,
+    request_batch_size=5,
+    temperature=1.0,
+    top_p=1.0,
+    num_cpus=16,
+    hosts=None,
+    workers_per_host=1,
+    max_in_flight=1,
+    seed=42,
+    prefetch=2,
+    blacklist_path=None,
+    similarity_threshold=0.7,
+    write_regen_json=True,
+    archive_responses=True,
+    shutdown_timeout=10.0,
+):
+    """Generate instructions with `workers_per_host` generator processes per Ollama host and one dedup coordinator.
+
+    `hosts` defaults to the comma-separated list in `OLLAMA_HOST`. Worker `w` draws its prompts from an RNG seeded
+    with `seed`, `w` and the number of instructions already generated, so a resumed run does not repeat prompts.
+    On shutdown, workers still in a request after `shutdown_timeout` seconds are terminated.
+    """
+    import tqdm
+    from rouge_score import rouge_scorer
+
+    import token_cache
+    from rouge_dedup import RougeScoringPool
+
+    seed_instruction_data = load_seed_instruction_data(seed_tasks_path)
+    print(f"Loaded {len(seed_instruction_data)} human-written seed instructions")
+    os.makedirs(output_dir, exist_ok=True)
+    log_path = os.path.join(output_dir, "regen.jsonl")
+    # a legacy regen.json is migrated into the log, as in generate_instruction_following_data
+    machine_instructions = [
+        d["instruction"] for d in regen_log.load_or_migrate(log_path, os.path.join(output_dir, "regen.json"))
+    ]
+    num_resumed = len(machine_instructions)
+    if num_resumed:
+        print(f"Loaded {num_resumed} machine-generated instructions")
+
+    hosts = ollama_client.parse_hosts(hosts or os.getenv("OLLAMA_HOST", "http://localhost:11434"))
+    worker_hosts = [host for host in hosts for _ in range(workers_per_host)]
+    config = dict(
+        model_name=model_name,
+        num_prompt_instructions=num_prompt_instructions,
+        request_batch_size=request_batch_size,
+        temperature=temperature,
+        top_p=top_p,
+        max_in_flight=max_in_flight,
+        blacklist_path=blacklist_path,
+    )
+    # the generators are forked before the corpus is loaded and before the scoring pool starts its own workers
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else None)
+    stop = ctx.Event()
+    queues, workers = [], []
+    for worker_id, host in enumerate(worker_hosts):
+        rounds = ctx.Queue(maxsize=prefetch)
+        worker = ctx.Process(
+            target=_generator_worker,
+            args=(worker_id, host, f"{seed}:{worker_id}:{num_resumed}", seed_instruction_data, config, rounds, stop),
+            daemon=True,
+        )
+        worker.start()
+        queues.append(rounds)
+        workers.append(worker)
+    print(f"Started {len(workers)} generator workers on {len(hosts)} hosts")
+
+    scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)
+    token_cache_path = os.path.join(output_dir, "regen.tokens")
+    vocab, corpus_ids, _ = token_cache.load_or_tokenize(
+        token_cache_path,
+        [d["instruction"] for d in seed_instruction_data] + machine_instructions,
+        scorer._tokenizer.tokenize,
+    )
+    # the scoring shards are the only copy of the token ids; the token cache is saved from them at the end
+    rouge_pool = RougeScoringPool(corpus_ids=corpus_ids, vocab=vocab, num_workers=num_cpus)
+    del corpus_ids, machine_instructions
+    checkpoint = regen_log.RegenLog(log_path)
+    quality_filter = InstructionFilter()
+    archive = None
+    if archive_responses:
+        archive = response_archive.ResponseArchive(os.path.join(output_dir, "raw_responses.jsonl.gz"))
+
+    progress_bar = tqdm.tqdm(total=num_instructions_to_generate, initial=num_resumed)
+    num_machine_instructions = num_resumed
+    generated, accepted = [0] * len(workers), [0] * len(workers)
+    start = time.time()
+    try:
+        sequence = 0
+        while num_machine_instructions < num_instructions_to_generate:
+            for worker_id, (rounds, worker) in enumerate(zip(queues, workers)):
+                if num_machine_instructions >= num_instructions_to_generate:
+                    break
+                round_sequence, candidates, counts, records = _next_round(rounds, worker, worker_id)
+                assert round_sequence == sequence
+                if archive is not None:
+                    archive.append(records)
+                quality_filter.counts.update(counts)
+                generated[worker_id] += len(candidates)
+                scores = rouge_pool.score_batch([tokens for _, tokens in candidates], similarity_threshold)
+                kept_entries = []
+                for (entry, _), rouge_scores in zip(candidates, scores):
+                    if rouge_scores is None:
+                        continue
+                    if num_machine_instructions >= num_instructions_to_generate:
+                        break
+                    entry["most_similar_instructions"], entry["avg_similarity_score"] = summarize_similarities(
+                        rouge_scores
+                    )
+                    kept_entries.append(entry)
+                    num_machine_instructions += 1
+                    progress_bar.update(1)
+                accepted[worker_id] += len(kept_entries)
+                checkpoint.append(kept_entries)
+            sequence += 1
+    except BaseException:
+        rouge_pool.close()
+        raise
+    finally:
+        stop.set()
+        _stop_workers(queues, workers, shutdown_timeout)
+        checkpoint.close()
+        if archive is not None:
+            archive.close()
+    progress_bar.close()
+    elapsed = time.time() - start
+    for worker_id, host in enumerate(worker_hosts):
+        print(f"Worker {worker_id} ({host}): generated {generated[worker_id]}, kept {accepted[worker_id]}")
+    print(f"Kept {num_machine_instructions - num_resumed} instructions in {elapsed:.2f}s")
+    print(f"Instruction filter: {quality_filter.report()}")
+    corpus_ids = rouge_pool.corpus_ids()
+    rouge_pool.close()
+    corpus_texts = [d["instruction"] for d in seed_instruction_data] + [
+        d["instruction"] for d in regen_log.load(log_path)
+    ]
+    # the last round can add candidates to the pool past the target; they come last and were never logged
+    token_cache.save(token_cache_path, corpus_texts, vocab, corpus_ids[: len(corpus_texts)])
+    if write_regen_json:
+        compact_regen_log(output_dir, seed_tasks_path)
+
+
+if __name__ == "__main__":
+    fire.Fire(generate_sharded)
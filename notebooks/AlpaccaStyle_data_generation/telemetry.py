@@ -0,0 +1,188 @@
+"""
+Process-wide telemetry for LLM calls.
+
+Every completed Ollama call is recorded with its client-side latency, the time it waited for a worker, and the
+server's own timings (`prompt_eval_duration`, `eval_duration`, `load_duration`, ...). From those the recorder keeps
+histograms of latency, prompt-eval and decode tokens/sec, queue wait and client overhead (latency not spent inside
+the server), plus totals and model-load events. `export` writes everything as JSON, which shows whether a run is
+bound by prompt evaluation, decoding or the client.
+"""
+import bisect
+import collections
+import json
+import math
+import threading
+import time
+
+# ollama reports durations in nanoseconds
+_NS = 1e9
+
+
+class Histogram(object):
+    """Fixed log-spaced buckets (`per_decade` per factor of 10 from `low` to `high`) plus exact count/sum/min/max."""
+
+    def __init__(self, low=1e-4, high=1e5, per_decade=10):
+        num = int(round(math.log10(high / low) * per_decade))
+        self.bounds = [low * 10 ** (i / per_decade) for i in range(num + 1)]
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the `q` quantile (clamped to the observed range)."""
+        if not self.count:
+            return None
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def to_dict(self):
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "buckets": [
+                {"le": self.bounds[i] if i < len(self.bounds) else "inf", "count": n}
+                for i, n in enumerate(self.buckets)
+                if n
+            ],
+        }
+
+
+class Telemetry(object):
+    """Thread-safe recorder of histograms and counters.
+
+    Args:
+        load_threshold: A call whose `load_duration` exceeds this many seconds counts as a model-load event.
+    """
+
+    def __init__(self, load_threshold=0.5):
+        self.load_threshold = load_threshold
+        self.started = time.time()
+        self.histograms = collections.defaultdict(Histogram)
+        self.totals = collections.Counter()
+        self.load_events = []
+        self._lock = threading.Lock()
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms[name].observe(value)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.totals[name] += n
+
+    def record_call(self, api, latency, data=None, queue_wait=None, time_to_first_token=None, failed=False):
+        """Record one call to `api` that took `latency` seconds and returned Ollama's final JSON object `data`."""
+        data = data or {}
+        with self._lock:
+            self.totals[f"{api}.calls"] += 1
+            if failed:
+                self.totals[f"{api}.failures"] += 1
+                return
+            self.histograms["latency"].observe(latency)
+            if queue_wait is not None:
+                self.histograms["queue_wait"].observe(queue_wait)
+            if time_to_first_token is not None:
+                self.histograms["time_to_first_token"].observe(time_to_first_token)
+            prompt_tokens, decode_tokens = data.get("prompt_eval_count") or 0, data.get("eval_count") or 0
+            prompt_seconds = (data.get("prompt_eval_duration") or 0) / _NS
+            decode_seconds = (data.get("eval_duration") or 0) / _NS
+            load_seconds = (data.get("load_duration") or 0) / _NS
+            total_seconds = (data.get("total_duration") or 0) / _NS
+            self.totals["prompt_tokens"] += prompt_tokens
+            self.totals["decode_tokens"] += decode_tokens
+            self.totals["prompt_eval_seconds"] += prompt_seconds
+            self.totals["decode_seconds"] += decode_seconds
+            self.totals["load_seconds"] += load_seconds
+            self.totals["latency_seconds"] += latency
+            if prompt_tokens and prompt_seconds:
+                self.histograms["prompt_tokens_per_second"].observe(prompt_tokens / prompt_seconds)
+            if decode_tokens and decode_seconds:
+                self.histograms["decode_tokens_per_second"].observe(decode_tokens / decode_seconds)
+            if total_seconds:
+                self.histograms["server_seconds"].observe(total_seconds)
+                self.histograms["client_overhead_seconds"].observe(max(latency - total_seconds, 0.0))
+            if load_seconds > self.load_threshold:
+                self.load_events.append({"time": time.time(), "api": api, "load_seconds": load_seconds})
+
+    def snapshot(self):
+        with self._lock:
+            totals = dict(self.totals)
+            decode_seconds = totals.get("decode_seconds", 0.0)
+            prompt_seconds = totals.get("prompt_eval_seconds", 0.0)
+            latency_seconds = totals.get("latency_seconds", 0.0)
+            # where the time of an average call went
+            breakdown = {}
+            if latency_seconds:
+                server = prompt_seconds + decode_seconds + totals.get("load_seconds", 0.0)
+                breakdown = {
+                    "prompt_eval": prompt_seconds / latency_seconds,
+                    "decode": decode_seconds / latency_seconds,
+                    "load": totals.get("load_seconds", 0.0) / latency_seconds,
+                    "client_and_queue": max(latency_seconds - server, 0.0) / latency_seconds,
+                }
+            return {
+                "wall_seconds": time.time() - self.started,
+                "totals": totals,
+                "time_breakdown": breakdown,
+                "load_events": list(self.load_events),
+                "histograms": {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def export(self, path):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=4)
+
+    def summary(self):
+        """One-line summary for logs."""
+        snapshot = self.snapshot()
+        totals, histograms = snapshot["totals"], snapshot["histograms"]
+        calls = sum(v for k, v in totals.items() if k.endswith(".calls"))
+        decode = histograms.get("decode_tokens_per_second", {}).get("mean")
+        prompt = histograms.get("prompt_tokens_per_second", {}).get("mean")
+        latency = histograms.get("latency", {}).get("p50")
+        parts = [f"{calls} calls"]
+        if latency is not None:
+            parts.append(f"p50 latency {latency:.2f}s")
+        if prompt is not None:
+            parts.append(f"prompt {prompt:.0f} tok/s")
+        if decode is not None:
+            parts.append(f"decode {decode:.0f} tok/s")
+        parts.append(f"{len(snapshot['load_events'])} model loads")
+        return ", ".join(parts)
+
+
+_default = Telemetry()
+
+
+def get():
+    """The process-wide recorder."""
+    return _default
+
+
+def reset():
+    """Start a fresh process-wide recorder (e.g. at the start of a run)."""
+    global _default
+    _default = Telemetry()
+    return _default
@@ -0,0 +1,87 @@
+"""
+Learned `max_tokens` budget for generation requests.
+
+A response is cut at "\n20" or at `max_tokens`, and a response cut by the limit loses its unfinished last instruction.
+`TokenBudgetEstimator` learns how many decoded tokens one generated instruction costs from Ollama's `eval_count`,
+so `max_tokens` can be set to just cover the instructions a prompt asks for instead of a fixed 3072. It also tracks
+the tokens spent on truncated tails and on rejected instructions.
+"""
+import collections
+import threading
+
+import numpy as np
+
+
+class TokenBudgetEstimator(object):
+    """Learns decoded tokens per generated instruction and derives a `max_tokens` budget from it.
+
+    Args:
+        default_max_tokens: Budget used until enough responses have been seen, and the upper bound afterwards.
+        min_max_tokens: Lower bound for the budget.
+        quantile: Quantile of the observed tokens per instruction to budget for, so most responses fit.
+        headroom: Extra factor on top of the quantile estimate.
+        min_observations: Number of responses needed before the estimate is used.
+        window: Number of recent responses the estimate is based on.
+    """
+
+    def __init__(
+        self,
+        default_max_tokens=3072,
+        min_max_tokens=256,
+        quantile=0.9,
+        headroom=1.1,
+        min_observations=8,
+        window=500,
+    ):
+        self.default_max_tokens = default_max_tokens
+        self.min_max_tokens = min_max_tokens
+        self.quantile = quantile
+        self.headroom = headroom
+        self.min_observations = min_observations
+        self.tokens_per_instruction = collections.deque(maxlen=window)
+        self.responses = 0
+        self.truncated = 0
+        self.decoded_tokens = 0
+        self.wasted_tokens = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, response, num_instructions):
+        """Record a response dict (with Ollama's `eval_count`) that yielded `num_instructions` complete blocks."""
+        if not response or response.get("eval_count") is None:
+            return
+        eval_count = response["eval_count"]
+        text = response["text"]
+        with self._lock:
+            self.responses += 1
+            self.decoded_tokens += eval_count
+            if response["finish_reason"] == "length" and text:
+                # the unfinished last block is discarded; charge its share of the decoded tokens as waste
+                self.truncated += 1
+                tail = len(text) - text.rfind("###") if "###" in text else len(text)
+                self.wasted_tokens += eval_count * tail / len(text)
+            if num_instructions:
+                self.tokens_per_instruction.append(eval_count / num_instructions)
+
+    def max_tokens(self, num_instructions):
+        """The `max_tokens` budget for a response that should contain `num_instructions` instructions."""
+        with self._lock:
+            if len(self.tokens_per_instruction) < self.min_observations:
+                return self.default_max_tokens
+            per_instruction = float(np.quantile(self.tokens_per_instruction, self.quantile))
+        budget = int(per_instruction * num_instructions * self.headroom)
+        return min(max(budget, self.min_max_tokens), self.default_max_tokens)
+
+    def report(self, num_accepted=None):
+        with self._lock:
+            report = {
+                "responses": self.responses,
+                "truncated": self.truncated,
+                "decoded_tokens": self.decoded_tokens,
+                "wasted_tail_tokens": int(self.wasted_tokens),
+                "tokens_per_instruction": (
+                    float(np.mean(self.tokens_per_instruction)) if self.tokens_per_instruction else None
+                ),
+            }
+        if num_accepted:
+            report["tokens_per_accepted_instruction"] = self.decoded_tokens / num_accepted
+        return report
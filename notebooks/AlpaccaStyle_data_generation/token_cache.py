@@ -0,0 +1,108 @@
+"""
+On-disk cache of the interned, tokenized instruction corpus.
+
+The file sits next to regen.json and holds the token vocabulary, an offsets array and a flat int32 array of
+token ids, keyed by a hash of the instruction texts. On resume it is memory-mapped instead of re-tokenizing
+every instruction; if the corpus has grown since it was written, the cached prefix is reused and only the new
+instructions are tokenized.
+
+Layout: MAGIC | uint64 header size | JSON header (padded to 8 bytes) | int64 offsets[n + 1] | int32 ids[...]
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from lcs_kernel import TokenVocab
+
+MAGIC = b"WHOTOKC1"
+
+
+def content_hash(instructions):
+    h = hashlib.sha256()
+    for inst in instructions:
+        h.update(inst.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def save(path, instructions, vocab, corpus_ids):
+    """Write the token ids of `instructions` (interned with `vocab`) to `path`."""
+    assert len(instructions) == len(corpus_ids)
+    lengths = np.fromiter((len(ids) for ids in corpus_ids), dtype=np.int64, count=len(corpus_ids))
+    offsets = np.zeros(len(corpus_ids) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    header = json.dumps(
+        {"content_hash": content_hash(instructions), "num_entries": len(corpus_ids), "vocab": vocab.tokens}
+    ).encode("utf-8")
+    header += b" " * (-len(header) % 8)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        f.write(offsets.tobytes())
+        for ids in corpus_ids:
+            f.write(np.asarray(ids, dtype=np.int32).tobytes())
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """Memory-map the cache at `path`. Returns (header, offsets, ids) or None if it is missing or unreadable.
+
+    A truncated or otherwise damaged file also gives None, so the caller rebuilds the cache instead of failing.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return _load(path)
+    except (ValueError, KeyError, TypeError, OSError):
+        return None
+
+
+def _load(path):
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        if len(MAGIC) + 8 + header_size > file_size:
+            return None
+        header = json.loads(f.read(header_size))
+    num_entries = header["num_entries"]
+    if not isinstance(num_entries, int) or num_entries < 0:
+        return None
+    if not isinstance(header["content_hash"], str) or not isinstance(header["vocab"], list):
+        return None
+    start = len(MAGIC) + 8 + header_size
+    if start + 8 * (num_entries + 1) > file_size:
+        return None
+    offsets = np.memmap(path, dtype=np.int64, mode="r", offset=start, shape=(num_entries + 1,))
+    num_tokens = int(offsets[-1])
+    if offsets[0] != 0 or np.any(np.diff(offsets) < 0) or start + offsets.nbytes + 4 * num_tokens != file_size:
+        return None
+    if num_tokens == 0:
+        return header, offsets, np.zeros(0, dtype=np.int32)
+    ids = np.memmap(path, dtype=np.int32, mode="r", offset=start + offsets.nbytes, shape=(num_tokens,))
+    return header, offsets, ids
+
+
+def load_or_tokenize(path, instructions, tokenize):
+    """Token ids for `instructions`, reusing the longest cached prefix and tokenizing the rest.
+
+    Returns:
+        (vocab, corpus_ids, num_cached): the vocabulary, one int32 id array per instruction, and how many of
+        them came from the cache.
+    """
+    cached = load(path)
+    vocab, corpus_ids = TokenVocab(), []
+    if cached is not None:
+        header, offsets, ids = cached
+        num_cached = header["num_entries"]
+        if num_cached <= len(instructions) and content_hash(instructions[:num_cached]) == header["content_hash"]:
+            vocab = TokenVocab(header["vocab"])
+            corpus_ids = [ids[offsets[i] : offsets[i + 1]] for i in range(num_cached)]
+    num_cached = len(corpus_ids)
+    corpus_ids += [vocab.encode(tokenize(inst)) for inst in instructions[num_cached:]]
+    return vocab, corpus_ids, num_cached
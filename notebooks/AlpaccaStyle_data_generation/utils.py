@@ -6,29 +6,26 @@ import io
 import sys
 import time
 import json
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Sequence, Union
 
-import openai
-import tqdm
-try:
-    from openai.openai_object import OpenAIObject
-except Exception:
-    class OpenAIObject(dict):
-        def to_dict_recursive(self):
-            return dict(self)
 import copy
 
 
 
 
-import os, requests, time
+import os, time
 
-def _ollama_generate(model, prompt, temperature=0.7, top_p=1.0, max_tokens=1024, stop=None, host=None):
-    host = host or os.getenv("OLLAMA_HOST", "http://localhost:11434")
+import completion_cache
+import ollama_client
+import telemetry
+
+def _ollama_payload(model, prompt, temperature, top_p, max_tokens, stop, stream):
     payload = {
         "model": model,
         "prompt": prompt,
-        "stream": False,
+        "stream": stream,
         "options": {
             "temperature": float(temperature),
             "top_p": float(top_p),
@@ -37,19 +34,130 @@ def _ollama_generate(model, prompt, temperature=0.7, top_p=1.0, max_tokens=1024,
     }
     if stop:
         payload["stop"] = stop
-    r = requests.post(f"{host.rstrip('/')}/api/generate", json=payload, timeout=600)
-    r.raise_for_status()
-    data = r.json()
-    # normalize to repo's expected shape
-    return {"text": data.get("response",""), "finish_reason": "stop"}
+    return payload
+
+
+class RequestCancelled(Exception):
+    """Raised by a request whose `cancel` event was set before it finished."""
+
+
+def _stream_chunks(host, payload):
+    """Decoded JSON chunks of a streaming /api/generate request. Closing the generator closes the response."""
+    r = ollama_client.post(host, "/api/generate", payload, timeout=600, stream=True)
+    try:
+        r.raise_for_status()
+        for line in r.iter_lines():
+            if line:
+                yield json.loads(line)
+    finally:
+        r.close()
+
+
+def _ollama_generate(
+    model, prompt, temperature=0.7, top_p=1.0, max_tokens=1024, stop=None, host=None, queue_wait=None, cancel=None
+):
+    """One completion. With a `cancel` event the response is streamed, so setting the event aborts the request
+    within one decoded chunk (and makes Ollama stop decoding) by raising `RequestCancelled`."""
+    host = host or os.getenv("OLLAMA_HOST", "http://localhost:11434")
+    payload = _ollama_payload(model, prompt, temperature, top_p, max_tokens, stop, stream=cancel is not None)
+    start = time.time()
+    try:
+        if cancel is None:
+            r = ollama_client.post(host, "/api/generate", payload, timeout=600)
+            r.raise_for_status()
+            data = r.json()
+        else:
+            if cancel.is_set():
+                raise RequestCancelled()
+            pieces, data = [], {}
+            chunks = _stream_chunks(host, payload)
+            try:
+                for data in chunks:
+                    if cancel.is_set():
+                        raise RequestCancelled()
+                    pieces.append(data.get("response", ""))
+                    if data.get("done"):
+                        break
+            finally:
+                chunks.close()
+            # the final chunk carries the token counts and done_reason of the whole completion
+            data = dict(data, response="".join(pieces))
+    except RequestCancelled:
+        telemetry.get().count("/api/generate.cancelled")
+        raise
+    except Exception:
+        telemetry.get().record_call("/api/generate", time.time() - start, queue_wait=queue_wait, failed=True)
+        raise
+    telemetry.get().record_call("/api/generate", time.time() - start, data, queue_wait=queue_wait)
+    # normalize to repo's expected shape; the token counts feed the max_tokens estimator
+    return {
+        "text": data.get("response",""),
+        "finish_reason": data.get("done_reason", "stop"),
+        "prompt_eval_count": data.get("prompt_eval_count"),
+        "eval_count": data.get("eval_count"),
+    }
+
+
+def ollama_generate_stream(model, prompt, temperature=0.7, top_p=1.0, max_tokens=1024, stop=None, host=None):
+    """Stream a completion from Ollama.
+
+    Yields `(text, None)` for each decoded chunk and finally `(text, finish_reason)`. Closing the generator
+    before it is exhausted closes the HTTP response, which makes Ollama stop decoding.
+    """
+    host = host or os.getenv("OLLAMA_HOST", "http://localhost:11434")
+    payload = _ollama_payload(model, prompt, temperature, top_p, max_tokens, stop, stream=True)
+    start = time.time()
+    first_token = None
+    done = False
+    chunks = _stream_chunks(host, payload)
+    try:
+        for data in chunks:
+            if first_token is None and data.get("response"):
+                first_token = time.time() - start
+            if data.get("done"):
+                done = True
+                telemetry.get().record_call(
+                    "/api/generate:stream", time.time() - start, data, time_to_first_token=first_token
+                )
+                yield data.get("response", ""), data.get("done_reason", "stop")
+                return
+            yield data.get("response", ""), None
+    finally:
+        if not done:
+            telemetry.get().count("/api/generate:stream.cancelled")
+        chunks.close()
+
+
+class _DictObject(dict):
+    def to_dict_recursive(self):
+        return dict(self)
+
 
+@functools.lru_cache(maxsize=None)
+def _openai():
+    import openai
 
-StrOrOpenAIObject = Union[str, OpenAIObject]
+    openai_org = os.getenv("OPENAI_ORG")
+    if openai_org is not None:
+        openai.organization = openai_org
+        logging.warning(f"Switching to organization: {openai_org} for OAI API key.")
+    return openai
 
-openai_org = os.getenv("OPENAI_ORG")
-if openai_org is not None:
-    openai.organization = openai_org
-    logging.warning(f"Switching to organization: {openai_org} for OAI API key.")
+
+def __getattr__(name):
+    # only the Ollama path is used, so openai (most of this module's import time) is imported on first access
+    if name == "openai":
+        return _openai()
+    if name == "OpenAIObject":
+        _openai()
+        try:
+            from openai.openai_object import OpenAIObject
+        except Exception:
+            OpenAIObject = _DictObject
+        return OpenAIObject
+    if name == "StrOrOpenAIObject":
+        return Union[str, __getattr__("OpenAIObject")]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 @dataclasses.dataclass
@@ -67,30 +175,112 @@ class OpenAIDecodingArguments(object):
     echo: bool = False
 
 
-def openai_completion(prompts, model_name, batch_size, decoding_args, logit_bias=None):
+def openai_completion(
+    prompts,
+    model_name,
+    batch_size,
+    decoding_args,
+    logit_bias=None,
+    max_in_flight=1,
+    cache=None,
+    batch_retries=2,
+    cancel=None,
+):
+    """Complete `prompts` with the Ollama backend.
+
+    With `decoding_args.n > 1`, every prompt is sampled `n` times. The samples of a prompt are sent as concurrent
+    requests with the identical prompt, so Ollama can reuse its cached prompt evaluation for them.
+
+    Args:
+        max_in_flight: Maximum number of concurrent requests. With 1, prompts are sent one at a time (but the `n`
+            samples of a prompt still run concurrently).
+        logit_bias: Not supported by Ollama; ignored with a warning.
+        cache: Optional `completion_cache.CompletionCache`; prompts already completed with the same decoding
+            arguments are served from it instead of calling the model. Defaults to `completion_cache.from_env()`.
+        batch_retries: When requests run concurrently and every one of them fails, the batch is retried this many
+            times, waiting 1s, 2s, 4s, ... in between, before the first error is raised.
+        cancel: Optional `threading.Event` (or anything with `is_set()`). Once it is set, requests still running
+            or not yet started are aborted and `RequestCancelled` is raised.
+
+    Returns:
+        One result dict per prompt, in prompt order, or a list of `n` result dicts per prompt if `n > 1`. When
+        requests run concurrently, a sample whose request failed is `None` (and the error is logged) instead of
+        aborting the rest of the batch, as long as at least one request succeeded.
+    """
     # decoding_args: has .temperature, .top_p, .max_tokens, .n, .stop
     temperature = getattr(decoding_args, "temperature", 0.7)
     top_p = getattr(decoding_args, "top_p", 1.0)
     max_tokens = getattr(decoding_args, "max_tokens", 1024)
     stop = getattr(decoding_args, "stop", None)
+    n = getattr(decoding_args, "n", 1) or 1
+    cache = cache if cache is not None else completion_cache.from_env()
+    if logit_bias:
+        _warn_once("logit_bias is not supported by the Ollama backend and is ignored.")
+
+    def generate(p, sample=0, submitted=None):
+        call = functools.partial(
+            _ollama_generate,
+            model=model_name,
+            prompt=p,
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            stop=stop,
+            queue_wait=time.time() - submitted if submitted is not None else None,
+            cancel=cancel,
+        )
+        if cache is None:
+            return call()
+        payload = _ollama_payload(model_name, p, temperature, top_p, max_tokens, stop, stream=False)
+        return cache.get_or_call(call, api="/api/generate", payload=payload, sample=sample)
 
-    results = []
-    for i in range(0, len(prompts), batch_size):
-        batch = prompts[i:i+batch_size]
-        for p in batch:
-            res = _ollama_generate(
-                model=model_name,
-                prompt=p,
-                temperature=temperature,
-                top_p=top_p,
-                max_tokens=max_tokens,
-                stop=stop,
-            )
-            results.append(res)
-            time.sleep(0.05)
+    # samples of the same prompt are adjacent, so they are dispatched together
+    jobs = [(p, sample) for p in prompts for sample in range(n)]
+    num_workers = max(max_in_flight, n) if n > 1 else max_in_flight
+    if num_workers > 1:
+        ollama_client.ensure_pool_size(num_workers)
+        attempt = 0
+        while True:
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                futures = [executor.submit(generate, p, sample, time.time()) for p, sample in jobs]
+            errors = [future.exception() for future in futures]
+            cancelled = [e for e in errors if isinstance(e, RequestCancelled)]
+            if cancelled:
+                raise cancelled[0]
+            # a host that is down or a wrong model name fails every request; don't hand back an all-None batch
+            if not jobs or not all(errors):
+                break
+            if attempt == batch_retries:
+                raise errors[0]
+            logging.warning(f"All {len(jobs)} requests failed ({errors[0]!r}), retrying in {2 ** attempt}s")
+            time.sleep(2**attempt)
+            attempt += 1
+        results = []
+        for idx, (future, error) in enumerate(zip(futures, errors)):
+            if error is not None:
+                logging.warning(f"Prompt {idx // n} (sample {idx % n}) failed: {error!r}")
+                results.append(None)
+            else:
+                results.append(future.result())
+    else:
+        results = []
+        for i in range(0, len(prompts), batch_size):
+            batch = prompts[i:i+batch_size]
+            for p in batch:
+                res = generate(p)
+                results.append(res)
+                time.sleep(0.05)
+    if n > 1:
+        # group the samples of each prompt, like the OpenAI API does for n > 1
+        results = [results[i : i + n] for i in range(0, len(results), n)]
     return results
 
 
+@functools.lru_cache(maxsize=None)
+def _warn_once(message):
+    logging.warning(message)
+
+
 def _make_w_io_base(f, mode: str):
     if not isinstance(f, io.IOBase):
         f_dirname = os.path.dirname(f)
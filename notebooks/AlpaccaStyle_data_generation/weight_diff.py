@@ -12,16 +12,26 @@
 #    See the License for the specific language governing permissions and
 #    limitations under the License.
 
+import functools
 from typing import Optional
 
 import fire
-import torch
-import tqdm
-import transformers
-from train import smart_tokenizer_and_embedding_resize
 
 
-@torch.inference_mode()
+def _inference_mode(fn):
+    """`torch.inference_mode()` as a decorator that imports torch only when `fn` runs."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        import torch
+
+        with torch.inference_mode():
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
+@_inference_mode
 def make_diff(
     path_raw: str, path_tuned: str, path_diff: str, device="cpu",  # "cuda" or "cpu"
 ):
@@ -32,6 +42,11 @@ def make_diff(
     Run:
         python weight_diff.py make_diff --path_raw <your_path_raw> --path_tuned <your_path_tuned> --path_diff <your_path_diff>
     """
+    import torch
+    import tqdm
+    import transformers
+    from train import smart_tokenizer_and_embedding_resize
+
     model_tuned: transformers.PreTrainedModel = transformers.AutoModelForCausalLM.from_pretrained(
         path_tuned,
         device_map={"": torch.device(device)},
@@ -67,7 +82,7 @@ def make_diff(
     tokenizer_tuned.save_pretrained(path_diff)
 
 
-@torch.inference_mode()
+@_inference_mode
 def recover(
     path_raw,
     path_diff,
@@ -93,6 +108,11 @@ def recover(
         - If you want to save the recovered weights, set `--path_tuned <your_path_tuned>`.
             Next time you can load the recovered weights directly from `<your_path_tuned>`.
     """
+    import torch
+    import tqdm
+    import transformers
+    from train import smart_tokenizer_and_embedding_resize
+
     model_raw: transformers.PreTrainedModel = transformers.AutoModelForCausalLM.from_pretrained(
         path_raw,
         device_map={"": torch.device(device)},